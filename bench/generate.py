@@ -0,0 +1,208 @@
+"""Synthetic declarations in the layout of the raw export, for benchmarks and for trying the scripts out
+
+Writes into the output directory:
+    source.csv - raw export with 318 columns, as fix.py expects it
+    tasks.txt, user_tasks.jsonl - task lists the filenames of the export were taken from
+    original.csv, movables.csv, positions.csv - inputs of merge.py
+
+Usage: python bench/generate.py output-dir num-rows [seed]
+"""
+import os
+import sys
+import csv
+import json
+import random
+
+NUM_COLS = 318
+COL_FILENAME = 1
+COL_EMAIL = 4
+COL_NAME = 11
+BOOLEAN_COLS = (2, 313, 315)
+YEAR_COLS = (3, 187, 191, 195, 199, 203, 207, 211, 215, 219, 223, 227, 231, 235, 239, 243, 245, 247, 249, 251, 253, 255,
+             257, 259, 261, 263, 265, 267, 269, 271)
+TEXT_COLS = (12, 13, 14, 15, 16, 17)
+FILLED_SHARE = 0.15  # Declarations are mostly empty
+DUPLICATES_SHARE = 0.05
+NEAR_DUPLICATES_SHARE = 0.05
+TASKS_PER_ROW = 1.2  # There are tasks that nobody entered yet
+USERS = 200
+
+SURNAMES = ('Іваненко', 'Петренко', 'Коваленко', 'Шевченко', 'Бондаренко', 'Ткаченко', 'Кравченко', 'Олійник',
+            'Мельник', 'Лисенко', 'Савченко', 'Руденко', 'Марченко', 'Поліщук', 'Мороз', 'Кравчук', 'Гончаренко',
+            'Левченко', 'Ковальчук', 'Бойко', 'Ткачук', 'Кушнір', 'Павленко', 'Литвиненко', 'Романенко')
+FIRST_NAMES = ('Олександр', 'Іван', 'Петро', 'Микола', 'Сергій', 'Андрій', 'Олена', 'Марія', 'Наталія', 'Тетяна',
+               'Юлія', 'Ірина', 'Віктор', 'Василь', 'Оксана')
+PATRONYMICS = ('Олександрович', 'Іванович', 'Петрович', 'Миколайович', 'Сергіївна', 'Андріївна', 'Василівна')
+TRANSLIT = str.maketrans('абвгґдеєжзиіїйклмнопрстуфхцчшщьюя', 'abvhgdeezzyiijklmnoprstufhccss_uj')
+REGIONS = ('Київ', 'Київська обл.', 'Львівська обл.', 'Харківська обл.', 'Одеська обл.', 'Дніпропетровська обл.')
+POSITIONS = ('Суддя', 'Прокурор', 'Начальник відділу', 'Заступник міністра', 'Депутат')
+HIDDEN = ('приховано', 'Приховано', '(приховано)', '"приховано"', '[Приховано]', '-приховано-')
+EMPTY = ('', '', '', '', '-', '—', '0', 'Прочерк', ' ')
+
+
+def typo(rnd, s):
+    """One random keyboard-like mistake"""
+    if len(s) < 2:
+        return s
+    pos = rnd.randrange(len(s) - 1)
+    kind = rnd.randrange(4)
+    if kind == 0:
+        return s[:pos] + s[pos + 1] + s[pos] + s[pos + 2:]
+    if kind == 1:
+        return s[:pos] + s[pos + 1:]
+    if kind == 2:
+        return s[:pos] + s[pos] + s[pos:]
+    return s[:pos] + rnd.choice('аеіоу') + s[pos + 1:]
+
+
+def money(rnd):
+    amount = rnd.randint(1, 5000000)
+    kind = rnd.randrange(6)
+    if kind == 0:
+        return str(amount)
+    if kind == 1:
+        return '{:,}'.format(amount).replace(',', ' ')
+    if kind == 2:
+        return '{},{:02d}'.format(amount, rnd.randint(0, 99))
+    if kind == 3:
+        return '{} грн.'.format(amount)
+    if kind == 4:
+        return '{}.{}'.format(amount, rnd.randint(0, 999))
+    return rnd.choice(HIDDEN)
+
+
+def year(rnd):
+    value = rnd.randint(1990, 2015)
+    return rnd.choice((str(value), str(value)[2:], '{} р.'.format(value), '{}р'.format(value)))
+
+
+def full_name(rnd, person):
+    surname, first_name, patronymic = person
+    kind = rnd.randrange(8)
+    if kind == 0:
+        name = '{} {}.{}.'.format(surname, first_name[0], patronymic[0])
+    elif kind == 1:
+        name = '{} {} {} (голова)'.format(surname, first_name, patronymic)
+    elif kind == 2:
+        name = '{} {} {}'.format(typo(rnd, surname), first_name, patronymic)
+    elif kind == 3:
+        name = '{} {} {}'.format(first_name, surname, patronymic)
+    else:
+        name = '{} {} {}'.format(surname, first_name, patronymic)
+    return name.lower() if rnd.random() < 0.1 else name
+
+
+def generate_tasks(rnd, num_rows):
+    tasks = []
+    people = []
+    for num in range(int(num_rows * TASKS_PER_ROW) + 1):
+        person = (rnd.choice(SURNAMES), rnd.choice(FIRST_NAMES), rnd.choice(PATRONYMICS))
+        fname = '{}_{}_{}'.format(person[0], person[1], num).lower().translate(TRANSLIT)
+        tasks.append('/declarations/{}/{}.pdf'.format(num % 100, fname))
+        people.append(person)
+    return tasks, people
+
+
+def generate_row(rnd, task, person, email):
+    row = [''] * NUM_COLS
+    for col in range(NUM_COLS):
+        if rnd.random() < FILLED_SHARE:
+            if col in YEAR_COLS:
+                row[col] = year(rnd)
+            elif col in BOOLEAN_COLS:
+                row[col] = rnd.choice(('так', 'Так', ''))
+            else:
+                row[col] = money(rnd)
+        elif rnd.random() < 0.05:
+            row[col] = rnd.choice(EMPTY)
+
+    row[0] = '2015-{:02d}-{:02d} {:02d}:{:02d}'.format(rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23),
+                                                        rnd.randint(0, 59))
+    fname = os.path.basename(task)
+    if rnd.random() < 0.3:
+        fname = typo(rnd, fname[:-4])
+    elif rnd.random() < 0.2:
+        fname = ' {} '.format(fname.upper())
+    row[COL_FILENAME] = fname
+    row[3] = year(rnd)
+    row[COL_EMAIL] = email
+    row[COL_NAME] = full_name(rnd, person)
+    for col in TEXT_COLS:
+        row[col] = rnd.choice(REGIONS + POSITIONS + ('', "суддя обласного суду", "м. Київ, вул. Хрещатик 1"))
+    return row
+
+
+def generate(output_dir, num_rows, seed=0):
+    rnd = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    tasks, people = generate_tasks(rnd, num_rows)
+    emails = ['volunteer{}@example.com'.format(num) for num in range(USERS)]
+
+    with open(os.path.join(output_dir, 'tasks.txt'), 'w', encoding='utf-8') as dest:
+        for task in tasks:
+            dest.write(task + '\n')
+
+    # Tasks are handed out to the volunteers in batches, some of them are entered by whoever wanted to
+    assigned = {}
+    with open(os.path.join(output_dir, 'user_tasks.jsonl'), 'w', encoding='utf-8') as dest:
+        for num, email in enumerate(emails):
+            files = list(range(num, len(tasks), len(emails)))
+            for task_num in files:
+                assigned[task_num] = email
+            dest.write(json.dumps({'email': email, 'files': [tasks[task_num] for task_num in files]},
+                                  ensure_ascii=False) + '\n')
+
+    header = ['Timestamp', 'Filename', 'Перевірено', 'Рік', 'Email'] + \
+             ['{}.{} Поле'.format(col // 4, col % 4) for col in range(5, NUM_COLS)]
+    rows = []
+    with open(os.path.join(output_dir, 'source.csv'), 'w', newline='', encoding='utf-8') as dest:
+        writer = csv.writer(dest)
+        writer.writerow(header)
+        for _ in range(num_rows):
+            if rows and rnd.random() < DUPLICATES_SHARE:
+                row = list(rnd.choice(rows))
+            elif rows and rnd.random() < NEAR_DUPLICATES_SHARE:
+                row = list(rnd.choice(rows))
+                row[rnd.randrange(20, NUM_COLS)] = money(rnd)
+            else:
+                task_num = rnd.randrange(len(tasks))
+                email = assigned[task_num] if rnd.random() < 0.9 else rnd.choice(emails)
+                row = generate_row(rnd, tasks[task_num], people[task_num], email)
+            writer.writerow(row)
+            # Only a window of the recent rows is kept to pick duplicates from, so memory stays flat
+            rows.append(row)
+            if len(rows) > 1000:
+                rows.pop(rnd.randrange(len(rows)))
+
+    generate_merge_inputs(rnd, output_dir, num_rows)
+
+
+def generate_merge_inputs(rnd, output_dir, num_rows):
+    """Reviewed groups as merge.py gets them: original rows, movables aligned with them and positions per group"""
+    group_nums = sorted(rnd.randrange(max(1, num_rows // 3)) for _ in range(num_rows))
+    with open(os.path.join(output_dir, 'original.csv'), 'w', newline='', encoding='utf-8') as original, \
+            open(os.path.join(output_dir, 'movables.csv'), 'w', newline='', encoding='cp1251') as movables:
+        original_writer = csv.writer(original, delimiter=';')
+        movables_writer = csv.writer(movables, delimiter=';')
+        original_writer.writerow(['Номер групи', 'ПІБ', 'Рік'] + ['{}.1 Поле'.format(col) for col in range(30)])
+        movables_writer.writerow(['ПІБ', 'Авто ОБЩ', 'Рік випуску ОБЩ', 'Результат сверки машин', 'Коментар'])
+        for num, group_num in enumerate(group_nums):
+            name = '{} {} {}'.format(rnd.choice(SURNAMES), rnd.choice(FIRST_NAMES), rnd.choice(PATRONYMICS))
+            original_writer.writerow([group_num, name, year(rnd)] + [money(rnd) for _ in range(30)])
+            movables_writer.writerow([name, rnd.choice(('ВАЗ 2107', 'Toyota Camry', '')), year(rnd),
+                                      rnd.choice(('збігається', 'не збігається')), ''])
+
+    with open(os.path.join(output_dir, 'positions.csv'), 'w', newline='', encoding='utf-8') as positions:
+        writer = csv.writer(positions, delimiter=';')
+        writer.writerow(['Номер групи', 'Регіон', 'Структура', 'Посада'])
+        for group_num in sorted(set(group_nums)):
+            writer.writerow([group_num, rnd.choice(REGIONS), 'Суд', rnd.choice(POSITIONS)])
+            if rnd.random() < 0.01:
+                writer.writerow([group_num, rnd.choice(REGIONS), 'Суд', rnd.choice(POSITIONS)])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit('Usage: {} output-dir num-rows [seed]'.format(sys.argv[0]))
+    generate(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    print('Generated {} rows in "{}"'.format(sys.argv[2], sys.argv[1]))
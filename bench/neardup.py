@@ -0,0 +1,44 @@
+"""Shows how near-duplicate detection scales with the number of rows: python bench/neardup.py [max-rows]"""
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from neardup import find_near_duplicates  # noqa: E402
+
+NUM_COLS = 300
+FILLED_COLS = 40  # Declarations are mostly empty
+DUPLICATES_SHARE = 0.1
+CHANGED_CELLS = 2  # Number of cells a near duplicate differs in
+THRESHOLD = 0.9
+
+
+def generate(num_rows, seed=0):
+    rnd = random.Random(seed)
+    rows = []
+    for _ in range(num_rows):
+        if rows and rnd.random() < DUPLICATES_SHARE:
+            row = list(rnd.choice(rows))
+            for col in rnd.sample(range(NUM_COLS), CHANGED_CELLS):
+                row[col] = str(rnd.randint(0, 10 ** 6))
+        else:
+            row = [''] * NUM_COLS
+            for col in rnd.sample(range(NUM_COLS), FILLED_COLS):
+                row[col] = str(rnd.randint(0, 10 ** 6))
+        rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_rows = 1000
+    print('{:>10} {:>10} {:>10} {:>12}'.format('rows', 'clusters', 'seconds', 'rows/sec'))
+    while num_rows <= max_rows:
+        rows = generate(num_rows)
+        started = time.perf_counter()
+        clusters = find_near_duplicates(rows, range(NUM_COLS), THRESHOLD)
+        elapsed = time.perf_counter() - started
+        print('{:>10} {:>10} {:>10.2f} {:>12.0f}'.format(num_rows, len(clusters), elapsed, num_rows / elapsed))
+        num_rows *= 10
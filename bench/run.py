@@ -0,0 +1,150 @@
+"""Times every stage of the scripts on the synthetic data from generate.py
+
+Usage: python bench/run.py [--sizes 10000,100000] [--save-baseline] [--baseline bench/baseline.json]
+
+Stages are timed on lists of the rows held in memory, so larger sizes, e.g. --sizes 1000000, need a few GB of it.
+
+Results are compared to the baseline if there is one, stages that got slower by more than TOLERANCE are flagged.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import tempfile
+
+from contextlib import contextmanager, redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'bin'))
+
+import fix  # noqa: E402
+import format  # noqa: E402
+import group  # noqa: E402
+import merge  # noqa: E402
+from generate import generate  # noqa: E402
+
+DEFAULT_SIZES = (10000, 100000)
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+TOLERANCE = 0.2
+
+
+@contextmanager
+def working_dir(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+class Timings(object):
+    def __init__(self, num_rows):
+        self.num_rows = num_rows
+        self.results = {}
+
+    @contextmanager
+    def stage(self, name, num_rows=None):
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            yield
+        elapsed = time.perf_counter() - started
+        num_rows = self.num_rows if num_rows is None else num_rows
+        self.results[name] = {'seconds': round(elapsed, 4), 'rows_per_sec': round(num_rows / elapsed if elapsed else 0)}
+        print('  {:<24} {:>10.2f}s {:>12.0f} rows/s'.format(name, elapsed, self.results[name]['rows_per_sec']))
+
+
+def run(data_dir, num_rows):
+    timings = Timings(num_rows)
+
+    with open(os.path.join(data_dir, 'source.csv'), newline='', encoding='utf-8') as source:
+        reader = csv.reader(source)
+        header = next(reader)
+        raw = list(reader)
+
+    # clean() is compared with the plain version of the rules in tests/test_clean.py
+    with timings.stage('clean'):
+        cleaned = [fix.clean(row) for row in raw]
+    del raw
+
+    with timings.stage('parse_tasks'):
+        tasks, ambiguous_tasks = fix.parse_tasks(os.path.join(data_dir, 'tasks.txt'))
+        user_tasks = fix.parse_user_tasks(os.path.join(data_dir, 'user_tasks.jsonl'))
+        tasks, user_tasks = fix.build_matchers(tasks, user_tasks)
+
+    augmented = []
+    with timings.stage('augment'):
+        for row in cleaned:
+            try:
+                augmented.append(fix.augment(fix.normalize(row), tasks, ambiguous_tasks, user_tasks))
+            except fix.ValidationError:
+                pass
+    del cleaned
+
+    with timings.stage('deduplicate'):
+        fix.deduplicate(list(augmented))
+    with timings.stage('merge_near_duplicates'):
+        fix.merge_near_duplicates(augmented)
+
+    with working_dir(data_dir):
+        processed_filename = 'processed.csv'
+        with timings.stage('write_dest'):
+            fix.write_dest(processed_filename, augmented, header)
+        del augmented
+
+        with timings.stage('load_source'):
+            processed_header, data = format.load_source(processed_filename)
+        with timings.stage('group_by_link_and_name'):
+            grouped = group.group_by_link_and_name(data)
+        with timings.stage('group_by_link'):
+            format.group_by_link(data)
+        with timings.stage('write_result'):
+            format.write_result(group.output_header(processed_header, data), grouped, format.NUM_SHEETS,
+                                format.HIGHLIGHT_COLS)
+        del data, grouped
+
+        with timings.stage('merge'):
+            merge.merge_files('original.csv', 'movables.csv', 'positions.csv')
+
+    return timings.results
+
+
+def compare(results, baseline):
+    """Print the stages that got slower than in the baseline"""
+    regressions = 0
+    for size, stages in results.items():
+        for stage, timing in stages.items():
+            previous = baseline.get(size, {}).get(stage)
+            if previous and timing['seconds'] > previous['seconds'] * (1 + TOLERANCE):
+                regressions += 1
+                print('REGRESSION {} rows, {}: {:.2f}s -> {:.2f}s'.format(
+                    size, stage, previous['seconds'], timing['seconds']))
+    if not regressions:
+        print('No regressions compared to the baseline')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the scripts on synthetic declarations')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma separated numbers of rows to generate')
+    parser.add_argument('--baseline', default=BASELINE, help='Results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    args = parser.parse_args()
+
+    results = {}
+    for num_rows in map(int, args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as data_dir:
+            print('Generating {} rows...'.format(num_rows))
+            generate(data_dir, num_rows)
+            results[str(num_rows)] = run(data_dir, num_rows)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as dest:
+            json.dump(results, dest, indent=2, sort_keys=True)
+        print('Baseline was written to: {}'.format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as source:
+            sys.exit(1 if compare(results, json.load(source)) else 0)
@@ -0,0 +1,185 @@
+"""Binary columnar format for the intermediate results passed between the scripts, mapped on load"""
+import json
+import math
+import mmap
+import struct
+
+from array import array
+from rowstore import ColumnStore
+
+EXTENSION = '.col'
+# MAGIC, 8-byte aligned data blocks, JSON with the header and offsets of the blocks, then the TRAILER
+MAGIC = b'ODCOLS01'
+TRAILER = struct.Struct('<QQ')  # Offset and length of the JSON header
+
+
+def is_columnar(filename):
+    return filename.endswith(EXTENSION)
+
+
+def column_type(values):
+    """Type of a column by its distinct values, anything mixed is stored as strings"""
+    if len(values) > 1 and all(isinstance(value, bool) for value in values[1:]):
+        return 'bool'
+    if len(values) > 1 and all(isinstance(value, float) for value in values[1:]):
+        return 'float'
+    return 'str'
+
+
+class BlockWriter(object):
+    def __init__(self, dest, magic=MAGIC):
+        self.dest = dest
+        self.offset = dest.write(magic)
+
+    def write(self, data):
+        """Write an 8-byte aligned block, returns its offset"""
+        padding = -self.offset % 8
+        self.offset += self.dest.write(b'\0' * padding)
+        offset = self.offset
+        self.offset += self.dest.write(data)
+        return offset
+
+    def write_strings(self, values):
+        """Write a list of strings, returns [blob offset, blob length, offsets offset] of it"""
+        offsets = array('Q', [0])
+        for value in values:
+            offsets.append(offsets[-1] + len(value))
+        # Offsets are in characters, the whole blob is decoded at once and sliced
+        blob = ''.join(values).encode('utf-8')
+        return [self.write(blob), len(blob), self.write(offsets.tobytes())]
+
+
+def dump(filename, store):
+    """Write a ColumnStore to the file"""
+    with open(filename, 'wb') as dest:
+        blocks = BlockWriter(dest)
+        columns = []
+        for codes, values in zip(store.codes, store.values):
+            col_type = column_type(values)
+            column = {'type': col_type, 'codes': [blocks.write(codes.tobytes()), codes.typecode]}
+            if col_type == 'bool':
+                column['values'] = values
+            elif col_type == 'float':
+                # An empty string is always the code 0, it's stored as NaN
+                column['values'] = blocks.write(array('d', [math.nan] + values[1:]).tobytes())
+            else:
+                column['values'] = blocks.write_strings([str(value) for value in values])
+            column['size'] = len(values)
+            columns.append(column)
+
+        header = json.dumps({
+            'rows': len(store),
+            'header': store.header,
+            'lengths': [blocks.write(store.lengths.tobytes()), store.lengths.typecode],
+            'columns': columns,
+        }, ensure_ascii=False).encode('utf-8')
+        header_offset = blocks.write(header)
+        dest.write(TRAILER.pack(header_offset, len(header)))
+
+
+class Writer(object):
+    """Collects the rows and writes them out on close(), used in place of csv.writer
+
+    Width of the codes of a column depends on the number of its distinct values, which is only known at the end, so
+    memory grows with the number of rows: 2 or 4 bytes per cell plus the distinct values.
+    """
+
+    def __init__(self, filename, header=None):
+        self.filename = filename
+        self.store = ColumnStore(header)
+
+    def writerow(self, row):
+        self.store.append(row)
+
+    def writerows(self, rows):
+        self.store.extend(rows)
+
+    def close(self):
+        dump(self.filename, self.store)
+
+
+def block(view, offset, typecode, count):
+    """Count items of the typecode in the block at the offset of a mapped file, used right from the mapping"""
+    size = array(typecode).itemsize
+    return view[offset:offset + size * count].cast(typecode)
+
+
+class StringTable(object):
+    """Sequence of strings sliced out of a decoded blob on access"""
+
+    def __init__(self, text, offsets):
+        self.text = text
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, num):
+        return self.text[self.offsets[num]:self.offsets[num + 1]]
+
+    def __iter__(self):
+        for num in range(len(self)):
+            yield self[num]
+
+    def __reduce__(self):
+        # Memory views can't be pickled, worker processes that aren't forked get a copy
+        return StringTable, (self.text, array('Q', self.offsets))
+
+
+class MappedColumns(object):
+    """Codes or values of the columns, decoded from the mapped file on the first access"""
+
+    def __init__(self, count, decode):
+        self.decoded = [None] * count
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.decoded)
+
+    def __getitem__(self, col):
+        decoded = self.decoded[col]
+        if decoded is None:
+            decoded = self.decoded[col] = self.decode(col)
+        return decoded
+
+
+def load(filename, lazy_values=False):
+    """Map the file into a ColumnStore, returns (header, store)
+
+    Lazy values make the first access of a column cheap and every access of a value a bit slower, which suits
+    reading a few rows better than scanning whole columns.
+    """
+    with open(filename, 'rb') as source:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if view[:len(MAGIC)] != MAGIC:
+        raise ValueError('"{}" is not a columnar file'.format(filename))
+    header_offset, header_length = TRAILER.unpack(view[-TRAILER.size:])
+    meta = json.loads(bytes(view[header_offset:header_offset + header_length]).decode('utf-8'))
+    num_rows = meta['rows']
+
+    def decode_codes(col):
+        offset, typecode = meta['columns'][col]['codes']
+        return block(view, offset, typecode, num_rows)
+
+    def decode_values(col):
+        column = meta['columns'][col]
+        if column['type'] == 'bool':
+            return column['values']
+        if column['type'] == 'float':
+            return [''] + list(block(view, column['values'], 'd', column['size']))[1:]
+        blob_offset, blob_length, offsets_offset = column['values']
+        offsets = block(view, offsets_offset, 'Q', column['size'] + 1)
+        text = bytes(view[blob_offset:blob_offset + blob_length]).decode('utf-8')
+        if lazy_values:
+            return StringTable(text, offsets)
+        return [text[offsets[i]:offsets[i + 1]] for i in range(column['size'])]
+
+    store = ColumnStore(meta['header'])
+    store.lengths = block(view, meta['lengths'][0], meta['lengths'][1], num_rows)
+    store.codes = MappedColumns(len(meta['columns']), decode_codes)
+    store.values = MappedColumns(len(meta['columns']), decode_values)
+    store.freeze()
+    print('Mapped {} rows from "{}"'.format(num_rows, filename))
+    return meta['header'], store
+
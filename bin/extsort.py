@@ -0,0 +1,80 @@
+"""External memory sorting: sorted runs are spilled to temporary files and merged back lazily"""
+import heapq
+import pickle
+import tempfile
+
+from operator import itemgetter
+
+MEMORY_BUDGET = 256 * 1024 * 1024  # Approximate size in bytes of the items kept in memory before spilling a run
+MAX_FAN_IN = 64  # Runs merged at once, each of them is an open file
+
+
+def estimate_size(item):
+    """Rough in-memory size of a row, good enough to decide when to spill without calling sys.getsizeof"""
+    if isinstance(item, dict):
+        item = item.values()
+    return 64 + sum(56 + len(str(value)) * 2 for value in item)
+
+
+def spill(items):
+    run = tempfile.TemporaryFile()
+    for item in items:
+        pickle.dump(item, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def read_run(run):
+    try:
+        while True:
+            try:
+                yield pickle.load(run)
+            except EOFError:
+                break
+    finally:
+        run.close()
+
+
+def external_sort(items, key, memory_budget=MEMORY_BUDGET, sizeof=estimate_size):
+    """Same as sorted(items, key=key) as an iterator, but only about memory_budget bytes of items are kept in memory
+
+    If everything fits into the budget no files are created at all. Otherwise every budget worth of items is sorted
+    and written to a temporary file and the files are k-way merged, at most MAX_FAN_IN of them at once: as soon as
+    there are that many runs of the same size they are merged into a single larger run, so the number of open files
+    stays small however many items there are. Both sorting and merging are stable.
+    """
+    runs = []  # (level, file) of the runs in the order of the items, levels never go up along the list
+    chunk = []
+    chunk_size = 0
+    for item in items:
+        chunk.append(item)
+        chunk_size += sizeof(item)
+        if chunk_size >= memory_budget:
+            chunk.sort(key=key)
+            runs.append((0, spill(chunk)))
+            chunk = []
+            chunk_size = 0
+            while len(runs) >= MAX_FAN_IN and len({level for level, _ in runs[-MAX_FAN_IN:]}) == 1:
+                runs[-MAX_FAN_IN:] = [(runs[-1][0] + 1, merge_runs(runs[-MAX_FAN_IN:], key))]
+
+    chunk.sort(key=key)
+    if not runs:
+        return iter(chunk)
+
+    # Room for the chunk in memory, only consecutive runs are merged so equal items keep their order
+    while len(runs) >= MAX_FAN_IN:
+        runs[-MAX_FAN_IN:] = [(runs[-1][0] + 1, merge_runs(runs[-MAX_FAN_IN:], key))]
+    print('Merging {} sorted runs spilled to disk...'.format(len(runs) + 1))
+    # heapq.merge takes equal items from the earlier runs first, which keeps the sort stable
+    return heapq.merge(*[read_run(run) for _, run in runs], iter(chunk), key=key)
+
+
+def merge_runs(runs, key):
+    """Merge the (level, file) runs into a new run file"""
+    return spill(heapq.merge(*[read_run(run) for _, run in runs], key=key))
+
+
+def sort_by_column(rows, col, memory_budget=MEMORY_BUDGET):
+    """(value, row) pairs of the rows as lists, in the stable order of the values of the column, see external_sort()"""
+    return external_sort(((row[col], list(row)) for row in rows), key=itemgetter(0), memory_budget=memory_budget,
+                         sizeof=lambda pair: estimate_size(pair[1]))
@@ -0,0 +1,164 @@
+"""Reading and writing of the CSV files, compressed ones included, with the throughput of every file reported
+
+Files ending with .gz are compressed with gzip and the ones ending with .zst with zstd, which needs the zstandard
+package. Rows written with BackgroundWriter are formatted, compressed and written by a thread of its own, so
+processing of the next rows goes on while the disk is busy, only a few batches of rows wait for it at any time.
+
+Rows per second are counted from opening a file to closing it, so for the files read and written while the rows are
+processed they show the throughput of the whole script rather than of the disk alone.
+"""
+import csv
+import gzip
+import time
+import queue
+import threading
+
+import instrument
+
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_LEVEL = 6  # Level 9 of the gzip module default is several times slower for a few percent smaller files
+COMPRESSION_RATIO = 8  # How much larger CSV files are than their compressed size, roughly, for the memory estimates
+WRITE_BATCH_SIZE = 1000  # Rows handed over to the writer thread at once
+WRITE_QUEUE_SIZE = 16  # Batches waiting to be written, the processing blocks once there are that many
+
+
+def is_compressed(filename):
+    return filename.endswith(('.gz', '.zst'))
+
+
+def open_text(filename, mode='r', encoding='utf-8', newline=''):
+    """Open a text file, decompressing or compressing it as the extension tells"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', compresslevel=GZIP_LEVEL, encoding=encoding, newline=newline)
+    if filename.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError('zstandard package is needed to read and write "{}"'.format(filename))
+        return zstandard.open(filename, mode + 't', encoding=encoding, newline=newline)
+    return open(filename, mode, newline=newline, encoding=encoding)
+
+
+def data_size(filename, size):
+    """Size of the data in a file of the size, estimated for the compressed files"""
+    return size * COMPRESSION_RATIO if is_compressed(filename) else size
+
+
+def report_throughput(action, filename, rows, seconds):
+    print('{} {} rows of "{}" in {:.1f}s, {} rows/s'.format(
+        action, rows, filename, seconds, round(rows / seconds) if seconds else rows))
+    instrument.add_file(filename, action.lower(), rows, seconds)
+
+
+class CountingReader(object):
+    """Rows of a csv reader counted on the way"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.rows = 0
+
+    @property
+    def fieldnames(self):
+        return self.reader.fieldnames
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.reader)
+        self.rows += 1
+        return row
+
+
+@contextmanager
+def reading(filename, encoding='utf-8', dict_rows=False, **fmtparams):
+    """csv reader of the file, or csv.DictReader with dict_rows set, for the time of the context"""
+    started = time.perf_counter()
+    with open_text(filename, 'r', encoding) as source:
+        reader = CountingReader((csv.DictReader if dict_rows else csv.reader)(source, **fmtparams))
+        yield reader
+    report_throughput('Read', filename, reader.rows, time.perf_counter() - started)
+
+
+class BackgroundWriter(object):
+    """Same as csv.writer, or csv.DictWriter if the fieldnames are set, but the writing is done by a thread
+
+    Rows are passed to the thread as they are, so they must not be changed once written. Errors of the thread are
+    raised by the next write or by close(). The thread starts with the first full batch, so worker processes that
+    are forked right after the file was opened, e.g. by fix.process_rows_parallel(), don't inherit it.
+    """
+
+    def __init__(self, filename, encoding='utf-8', fieldnames=None, **fmtparams):
+        self.filename = filename
+        self.dest = open_text(filename, 'w', encoding)
+        if fieldnames is None:
+            self.writer = csv.writer(self.dest, **fmtparams)
+        else:
+            self.writer = csv.DictWriter(self.dest, fieldnames, **fmtparams)
+        self.batch = []
+        self.rows = 0
+        self.error = None
+        self.queue = queue.Queue(WRITE_QUEUE_SIZE)
+        self.started = time.perf_counter()
+        self.thread = None
+
+    def run(self):
+        try:
+            for batch in iter(self.queue.get, None):
+                self.writer.writerows(batch)
+        except BaseException as e:
+            self.error = e
+            # The rest of the batches are thrown away, so the processing doesn't block on a full queue
+            for _ in iter(self.queue.get, None):
+                pass
+
+    def writeheader(self):
+        self.writerow(dict(zip(self.writer.fieldnames, self.writer.fieldnames)))
+
+    def writerow(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= WRITE_BATCH_SIZE:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='writer of {}'.format(self.filename), daemon=True)
+            self.thread.start()
+        self.rows += len(self.batch)
+        self.queue.put(self.batch)
+        self.batch = []
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.stop()
+        if self.error is not None:
+            raise self.error
+        report_throughput('Wrote', self.filename, self.rows, time.perf_counter() - self.started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # What is being raised matters more than the rows that didn't make it to the file
+            self.stop()
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+        self.dest.close()
@@ -1,16 +1,33 @@
 import sys
 import os
 import json
-import csv
 import re
 import string
+import argparse
+import multiprocessing
 
-import Levenshtein
+import memo
+import fileio
+import matcher
+import instrument
+import taskindex
 
+from contextlib import contextmanager
 from datetime import datetime
-from hashlib import md5
-from collections import defaultdict, Counter
+from hashlib import blake2b
+from collections import defaultdict, Counter, deque
 from decimal import Decimal
+from functools import partial
+from itertools import islice
+from operator import itemgetter
+from matcher import TaskMatcher
+from linkcache import LinkCache, files_digest
+from manifest import RowManifest
+from seenindex import SeenIndex
+from neardup import find_near_duplicates
+from columnar import is_columnar, Writer as ColumnarWriter
+from extsort import sort_by_column, MEMORY_BUDGET
+from rowstore import ColumnStore, argsort, column
 
 
 COL_FILENAME = 1  # "Filename" column number
@@ -22,21 +39,28 @@ COL_NOT_FOUND_IN_USER_TASKS = 320  # Debug flags
 COL_TASKNAME_IS_AMBIGUOS = 321  # Debug flags
 COL_NAME_NORMALIZED = 322  # Attempt to normalize lastnames
 COL_NAME_TROUBLESOME = 323  # Lastnames troublesomnes flag
+COL_LINK_SCORE = 324  # Similarity of the filename and the matched task
+COL_LINK_MARGIN = 325  # How much better the matched task is than the runner-up
 DEBUG_COLS = (
     COL_LINK, COL_NAME, COL_FILENAME, COL_EMAIL, COL_NOT_FOUND_IN_USER_TASKS,
     COL_TASKNAME_IS_AMBIGUOS, COL_NAME_NORMALIZED,
-    COL_NAME_TROUBLESOME)
+    COL_NAME_TROUBLESOME, COL_LINK_SCORE, COL_LINK_MARGIN)
 
 USELESS_COLS = (5, 6, 7, 8, 9, 10, COL_HASH, COL_NOT_FOUND_IN_USER_TASKS,
                 COL_TASKNAME_IS_AMBIGUOS, COL_NAME_TROUBLESOME)  # No point in processing and writing these into the output
 BOOLEAN_COLS = (2, 313, 315)  # Should be treated as booleans
 #NON_HASHABLE_COLS = (0, 1, 4, 313, 315)  # Technical fields that shouldn't be used for deduplication, strict version
-NON_HASHABLE_COLS = (0, 1, 2, 3, 4, 312, 313, 314, 315, 316, 317)  # Technical fields that shouldn't be used for deduplication
+NON_HASHABLE_COLS = (0, 1, 2, 3, 4, 312, 313, 314, 315, 316, 317, COL_LINK_SCORE, COL_LINK_MARGIN)  # Technical fields that shouldn't be used for deduplication
 CAPITALIZE_COLS = (13, 14)
+CHUNK_SIZE = 1000  # Number of rows sent to a worker process at once
+NEAR_DUPLICATE_THRESHOLD = 0.9  # Share of the same non-empty hashable values for rows to be merged as duplicates
 YEAR_COLS = (3, 187, 191, 195, 199, 203, 207, 211, 215, 219, 223, 227, 231, 235, 239, 243, 245, 247, 249, 251, 253, 255,
              257, 259, 261, 263, 265, 267, 269, 271)  # Should be treated as year values (not subject to decimal detection)
 
 
+capwords = string.capwords  # Module level to be memoized along with the other normalizers
+
+
 def title(s):
     chunks = s.split()
     chunks = map(lambda x: string.capwords(x, "-"), chunks)
@@ -47,31 +71,247 @@ class ValidationError(Exception):
     pass
 
 
-def process_source(source_filename, tasks_filename, user_tasks_filename):
-    tasks, ambiguous_tasks = parse_tasks(tasks_filename)
-    user_tasks = parse_user_tasks(user_tasks_filename)
+def process_source(source_filename, tasks_filename, user_tasks_filename, workers=1, link_cache_filename=None,
+                   manifest_filename=None, output_format='csv', task_index_filename=None, seen_index_filename=None,
+                   dest=None):
+    """Clean and augment the rows of the source file, returns what dest returns
+
+    Valid and invalid rows are written to the processed_<timestamp> and invalid_<timestamp> files in the output format
+    unless dest is set, it's called with the header and an iterator of (row, is_valid) pairs in the order of the source
+    instead, e.g. to keep the rows in memory.
+    """
+    tasks, ambiguous_tasks, user_tasks = load_tasks(tasks_filename, user_tasks_filename, task_index_filename)
+    link_cache, manifest, seen_index = open_caches(tasks_filename, user_tasks_filename, link_cache_filename,
+                                                   manifest_filename, seen_index_filename)
 
-    header = None
-    data = []
-    invalid = []
-    with open(source_filename, 'r', newline='', encoding='utf-8') as source:
+    if dest is None:
+        timestamp = datetime.now()
+        dest = partial(write_results,
+                       processed_filename='processed_{:%Y-%m-%d_%H:%M:%S}.{}'.format(timestamp, output_format),
+                       invalid_filename='invalid_{:%Y-%m-%d_%H:%M:%S}.{}'.format(timestamp, output_format))
+
+    counts = Counter()
+    with fileio.reading(source_filename) as reader, instrument.stage('process_rows') as stage:
         print('Reading the file "{}"'.format(source_filename))
-        reader = csv.reader(source)
         header = next(reader)  # skip the header but store for later usage
-        print('Loading rows...')
-        for row in reader:
-            try:
-                data.append(augment(normalize(clean(row)), tasks, ambiguous_tasks, user_tasks))
-            except ValidationError:
-                invalid.append(row)
-        print('Loaded rows: {} and {} invalid'.format(len(data), len(invalid)))
-
-    timestamp = datetime.now()
-    write_dest('processed_{:%Y-%m-%d_%H:%M:%S}.csv'.format(timestamp), data, header)
-    write_dest('invalid_{:%Y-%m-%d_%H:%M:%S}.csv'.format(timestamp), invalid, header)
+
+        results = process_all(reader, tasks, ambiguous_tasks, user_tasks, workers, link_cache, manifest, seen_index)
+        result = dest(header, count_results(results, counts))
+        stage.rows = counts[True] + counts[False]
+
+    print('Processed rows: {} and {} invalid'.format(counts[True], counts[False]))
+    memo.print_stats()
+    instrument.count('rows.processed', counts[True])
+    instrument.count('rows.invalid', counts[False])
+    save_caches(link_cache, manifest, seen_index)
 
     # write_debug_dest('processed_debug.csv', data, header)
     # write_debug_dest('invalid_debug.csv', invalid, header)
+    return result
+
+
+def load_tasks(tasks_filename, user_tasks_filename, index_filename=None):
+    """Parse and index both task lists, returns (tasks, ambiguous_tasks, user_tasks) the way augment() takes them
+
+    With the index filename the lists are mapped from the compiled index instead, which is rebuilt first if the
+    lists have changed since it was compiled.
+    """
+    with instrument.stage('parse_tasks') as stage:
+        if index_filename is None:
+            tasks, ambiguous_tasks = parse_tasks(tasks_filename)
+            tasks, user_tasks = build_matchers(tasks, parse_user_tasks(user_tasks_filename))
+        elif taskindex.is_fresh(index_filename, task_sources(tasks_filename, user_tasks_filename)):
+            tasks, ambiguous_tasks, user_tasks = taskindex.load(index_filename)
+        else:
+            print('Task index "{}" is missing or outdated, compiling it'.format(index_filename))
+            tasks, ambiguous_tasks, user_tasks = compile_tasks(tasks_filename, user_tasks_filename, index_filename)
+        stage.rows = len(tasks)
+    return tasks, ambiguous_tasks, user_tasks
+
+
+def task_sources(tasks_filename, user_tasks_filename):
+    """Files the compiled task index depends on, the code normalizing the filenames included"""
+    return tasks_filename, user_tasks_filename, __file__, matcher.__file__
+
+
+def compile_tasks(tasks_filename, user_tasks_filename, index_filename):
+    """Parse and index both task lists and write them out as a task index, returns the same as load_tasks()"""
+    tasks, ambiguous_tasks = parse_tasks(tasks_filename)
+    tasks, user_tasks = build_matchers(tasks, parse_user_tasks(user_tasks_filename))
+    taskindex.dump(index_filename, tasks, ambiguous_tasks, user_tasks,
+                   task_sources(tasks_filename, user_tasks_filename))
+    return tasks, ambiguous_tasks, user_tasks
+
+
+def open_caches(tasks_filename, user_tasks_filename, link_cache_filename=None, manifest_filename=None,
+                seen_index_filename=None):
+    """LinkCache and RowManifest for the task lists and the SeenIndex, None for the ones without a filename"""
+    link_cache = None
+    if link_cache_filename:
+        # Filenames are normalized and resolved here and scored by the matcher, so a change of either of them
+        # invalidates the resolutions as well
+        link_cache = LinkCache(link_cache_filename,
+                               files_digest(tasks_filename, user_tasks_filename, __file__, matcher.__file__))
+    manifest = None
+    if manifest_filename:
+        # Results also depend on the processing code itself, so it's a part of the digest
+        manifest = RowManifest(manifest_filename, files_digest(tasks_filename, user_tasks_filename,
+                                                               __file__, matcher.__file__))
+    seen_index = SeenIndex(seen_index_filename) if seen_index_filename else None
+    return link_cache, manifest, seen_index
+
+
+def save_caches(link_cache, manifest, seen_index=None):
+    with instrument.stage('save_state'):
+        if manifest is not None:
+            manifest.save()
+
+        if seen_index is not None:
+            instrument.count('dedupe.seen_before', seen_index.seen_before)
+            instrument.count('dedupe.repeated', seen_index.repeated)
+            seen_index.save()
+
+        if link_cache is not None:
+            print('Link cache hits: {}, misses: {}'.format(link_cache.hits, link_cache.misses))
+            instrument.count('link_cache.hits', link_cache.hits)
+            instrument.count('link_cache.misses', link_cache.misses)
+            link_cache.save()
+
+
+def process_all(rows, tasks, ambiguous_tasks, user_tasks, workers=1, link_cache=None, manifest=None, seen_index=None):
+    """Run raw rows through the processing in parallel and/or incrementally as set, yields (row, is_valid) pairs
+
+    With a SeenIndex the valid rows written by the earlier runs or earlier in this run are dropped.
+    """
+    if workers > 1:
+        print('Processing rows with {} workers...'.format(workers))
+
+        def process(rows):
+            return process_rows_parallel(rows, tasks, ambiguous_tasks, user_tasks, workers, link_cache)
+    else:
+        print('Processing rows...')
+
+        def process(rows):
+            return process_rows(rows, tasks, ambiguous_tasks, user_tasks, link_cache)
+
+    results = process(rows) if manifest is None else process_rows_incremental(rows, manifest, process)
+    if seen_index is not None:
+        return drop_seen(results, seen_index)
+    return results
+
+
+def drop_seen(results, seen_index):
+    for row, is_valid in results:
+        if not is_valid or seen_index.add(row[COL_HASH]):
+            yield row, is_valid
+
+
+def count_results(results, counts):
+    """Pass the (row, is_valid) pairs through, counting them by is_valid"""
+    for row, is_valid in results:
+        counts[is_valid] += 1
+        yield row, is_valid
+
+
+def write_results(header, results, processed_filename, invalid_filename):
+    """Write the (row, is_valid) pairs to the files of the valid and the invalid rows as they come"""
+    # Rows are written as soon as they are processed so memory usage doesn't depend on the size of the source
+    with open_dest(processed_filename, header) as processed_writer, \
+            open_dest(invalid_filename, header) as invalid_writer:
+        for row, is_valid in results:
+            write_row(processed_writer if is_valid else invalid_writer, row)
+
+    print('Result was written to: {}'.format(processed_filename))
+    print('Result was written to: {}'.format(invalid_filename))
+
+
+def process_rows(rows, tasks, ambiguous_tasks, user_tasks, link_cache=None):
+    """Run raw rows through clean/normalize/augment one at a time, yields (row, is_valid) pairs"""
+    for row in rows:
+        try:
+            yield augment(normalize(clean(row)), tasks, ambiguous_tasks, user_tasks, link_cache), True
+        except ValidationError:
+            # Invalid rows are written as is
+            yield row, False
+
+
+def process_rows_incremental(rows, manifest, process):
+    """Take results of unchanged rows from the manifest of the previous run and pass the rest through process()"""
+    pending = deque()  # Hashes of the rows read so far and whether they are in the manifest
+
+    def changed_rows():
+        for row in rows:
+            row_hash = manifest.row_hash(row)
+            is_known = row_hash in manifest
+            pending.append((row_hash, is_known))
+            if not is_known:
+                yield row
+
+    # process() returns results in the order of the rows it gets, so the known rows read before the next processed
+    # one are put back in between to keep the order of the source
+    for row, is_valid in process(changed_rows()):
+        row_hash, is_known = pending.popleft()
+        while is_known:
+            yield manifest.reuse(row_hash)
+            row_hash, is_known = pending.popleft()
+        manifest.add(row_hash, row, is_valid)
+        yield row, is_valid
+
+    for row_hash, _ in pending:
+        yield manifest.reuse(row_hash)
+
+
+worker_tasks = None  # Task lookup tables of a worker process
+
+
+def init_worker(tasks, ambiguous_tasks, user_tasks, link_cache, rules):
+    global worker_tasks
+    worker_tasks = (tasks, ambiguous_tasks, user_tasks, link_cache)
+    # Forked workers get the rules the way the parent has set them up, spawned ones import the module anew and set
+    # them up here
+    report_filename, counted, memo_size = rules
+    if report_filename is not None and not instrument.enabled():
+        instrument.enable(report_filename)
+    if counted and not rules_counted:
+        count_clean_rules()
+    if memo_size and not rules_memo_size:
+        memoize_rules(memo_size)
+    # Hits of the parent are counted by the parent itself
+    memo.clear()
+
+
+def process_chunk(rows):
+    results = list(process_rows(rows, *worker_tasks))
+    link_cache = worker_tasks[-1]
+    # Each worker has its own copy of the cache and counters, so what it has learned is sent back to the parent
+    # with the rows
+    return (results, link_cache.take_updates() if link_cache is not None else None, instrument.take_counters(),
+            memo.take_stats())
+
+
+def process_rows_parallel(rows, tasks, ambiguous_tasks, user_tasks, workers, link_cache=None):
+    """Same as process_rows() but chunks of rows are processed by a pool of worker processes"""
+    # Matchers are passed to the initializer, so chunks of rows are all that goes to the workers afterwards
+    with multiprocessing.Pool(workers, initializer=init_worker,
+                              initargs=(tasks, ambiguous_tasks, user_tasks, link_cache,
+                                        (instrument.report_filename, rules_counted, rules_memo_size))) as pool:
+        # Only a few chunks per worker are in flight at any time so the source isn't read into memory as a whole
+        pending = deque()
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, CHUNK_SIZE))
+            if chunk:
+                pending.append(pool.apply_async(process_chunk, (chunk,)))
+            if pending and (not chunk or len(pending) >= workers * 2):
+                # Results are consumed in submission order which keeps the order of the source
+                results, cache_updates, counters, memo_stats = pending.popleft().get()
+                if cache_updates is not None:
+                    link_cache.add_updates(cache_updates)
+                instrument.add_counters(counters)
+                memo.add_stats(memo_stats)
+                yield from results
+            elif not chunk:
+                break
 
 
 def normalize_fname(filename):
@@ -101,7 +341,7 @@ def normalize_name(name):
 def parse_user_tasks(filename):
     tasks_per_user = {}
 
-    with open(filename, 'r') as tasks:
+    with fileio.open_text(filename, newline=None) as tasks:
         print('Reading tasks file "{}"'.format(filename))
 
         for task_line in tasks:
@@ -121,7 +361,7 @@ def parse_tasks(filename):
     data = defaultdict(list)
     ambiguous_tasks = Counter()
 
-    with open(filename, 'r') as tasks:
+    with fileio.open_text(filename, newline=None) as tasks:
         print('Reading tasks file "{}"'.format(filename))
         for task in tasks:
             task_fname = normalize_fname(task)
@@ -131,19 +371,44 @@ def parse_tasks(filename):
     return data, ambiguous_tasks
 
 
+def build_matchers(tasks, user_tasks):
+    """Index the output of parse_tasks() and parse_user_tasks() for the fuzzy search"""
+    return (TaskMatcher.from_buckets(tasks),
+            {email: TaskMatcher.from_buckets(buckets) for email, buckets in user_tasks.items()})
+
+
+def processed_row(row):
+    """Columns of the row that make it to the results, the other scripts count columns in this layout"""
+    return [c for i, c in enumerate(row) if i not in USELESS_COLS]
+
+
+def write_row(writer, row):
+    # Values are passed as they are, csv converts them with str() while columnar files keep their types
+    writer.writerow(processed_row(row))
+
+
+@contextmanager
+def open_dest(filename, header):
+    """Writer of the rows to a CSV, a compressed one or a columnar file, judging by the extension"""
+    if is_columnar(filename):
+        writer = ColumnarWriter(filename, processed_row(header))
+        yield writer
+        writer.close()
+    else:
+        with fileio.BackgroundWriter(filename) as writer:
+            write_row(writer, header)
+            yield writer
+
+
 def write_dest(filename, data, header):
-    with open(filename, 'w', newline='', encoding='utf-8') as dest:
-        writer = csv.writer(dest)
-        data.insert(0, header)
+    with open_dest(filename, header) as writer:
         for row in data:
-            writer.writerow([str(c) for i, c in enumerate(row) if i not in USELESS_COLS])
+            write_row(writer, row)
     print('Result was written to: {}'.format(filename))
 
 
 def write_debug_dest(filename, data, header):
-    with open(filename, 'w', newline='', encoding='utf-8') as dest:
-        writer = csv.writer(dest)
-
+    with fileio.BackgroundWriter(filename) as writer:
         writer.writerow([str(c) for i, c in enumerate(header) if i in DEBUG_COLS])
 
         for row in data:
@@ -151,52 +416,181 @@ def write_debug_dest(filename, data, header):
     print('Result was written to: {}'.format(filename))
 
 
+# Precompiled patterns for the cleaning rules, see tests/test_clean.py for the plain version of them
+WHITESPACE_RE = re.compile(r'\s')
+HIDDEN_RE = re.compile(r'["(-\[]приховано[")-\]]', flags=re.I)
+CURRENCY_RE = re.compile(r'грн?\.?$')
+DECIMAL_COMMA_RE = re.compile(r'(\d+),(\d+)')
+MONEY_RE = re.compile(r'\d+\.\d{1,2}')
+APOSTROPHE_RE = re.compile(r'([^a-zA-Z\d_])["\'`*]([^a-zA-Z\d_])')
+UKRAINIAN_I_RE = re.compile(r'([^a-zA-Z\d_])[1i]([^a-zA-Z\d_])')
+EMPTY_VALUES = frozenset(('0', 'Прочерк', 'прочерк'))
+CENTS = Decimal('.01')
+
+
+def _quantize_money(match):
+    return str(Decimal(match.group(0)).quantize(CENTS))
+
+
+def _strip_cell(col):
+    """Whitespace and "nothing here" markers handling shared by all of the columns"""
+    if not col.isalnum():
+        col = WHITESPACE_RE.sub(' ', col.replace('\n', ';')).strip()
+    if col in EMPTY_VALUES or not col.strip('-—'):
+        return ''
+    return col
+
+
+def _fix_apostrophes(col):
+    return APOSTROPHE_RE.sub(r'\g<1>’\g<2>', col)
+
+
+def _fix_ukrainian_i(col):
+    return UKRAINIAN_I_RE.sub(r'\g<1>і\g<2>', col)
+
+
+def _fix_text(col):
+    """Rules applied to any non-empty non-boolean cell after the type specific ones"""
+    if '"' in col or "'" in col or '`' in col or '*' in col:
+        col = _fix_apostrophes(col)
+    if '1' in col or 'i' in col:
+        col = _fix_ukrainian_i(col)
+    return col
+
+
+def _fix_hidden(col):
+    col = HIDDEN_RE.sub('приховано', col)
+    if col == 'Приховано':
+        col = 'приховано'
+    return col
+
+
+def _fix_money(col):
+    col = CURRENCY_RE.sub('', col).rstrip()
+    digits = col.replace(',', '').replace('.', '').replace(' ', '')
+    if (not digits or digits.isdigit()) and ', ' not in col:
+        # Remove spaces if it looks like a decimal without any other chars
+        col = col.replace(' ', '')
+    if ',' in col:
+        col = DECIMAL_COMMA_RE.sub(r'\g<1>.\g<2>', col)
+    if '.' in col:
+        # Coerce money-looking decimals to a common format
+        col = MONEY_RE.sub(_quantize_money, col)
+    if not col or col.isdigit():
+        col = '{}.00'.format(col)
+    return col
+
+
+def _fix_year(col):
+    if len(col) > 10:
+        return _fix_money(col)
+    col = ''.join(filter(str.isdigit, col))
+    if len(col) == 2:
+        col = '20{}'.format(col)
+    return col
+
+
+rules_counted = False  # Whether count_clean_rules() was called
+rules_memo_size = 0  # Size of the caches of memoize_rules(), 0 unless it was called
+
+
+def count_clean_rules():
+    """Count how often every cleaning rule changes a cell, the counters end up in the run report
+
+    Call it before memoize_rules(), the caches then count the rules of the values they have found as well.
+    """
+    global _strip_cell, _fix_hidden, _fix_money, _fix_year, _fix_apostrophes, _fix_ukrainian_i, rules_counted
+    rules_counted = True
+    # The rules are looked up by name on every call, so wrapping them here leaves clean() untouched and free of any
+    # counting when the report isn't requested
+    _strip_cell = instrument.counted('clean.strip', _strip_cell)
+    _fix_hidden = instrument.counted('clean.hidden', _fix_hidden)
+    _fix_money = instrument.counted('clean.money', _fix_money)
+    _fix_year = instrument.counted('clean.year', _fix_year)
+    _fix_apostrophes = instrument.counted('clean.apostrophes', _fix_apostrophes)
+    _fix_ukrainian_i = instrument.counted('clean.ukrainian_i', _fix_ukrainian_i)
+
+
+def memoize_rules(size=memo.MEMO_SIZE):
+    """Cache the cleaning rules and the normalizers of the names and filenames for the size of the latest values"""
+    global clean_boolean, clean_year, clean_text, clean_capitalized, normalize_name, normalize_fname, title, capwords
+    global rules_memo_size
+    rules_memo_size = size
+    text = clean_text
+    clean_boolean = memo.memoize('clean_boolean', clean_boolean, size)
+    clean_year = memo.memoize('clean_year', clean_year, size)
+    clean_text = memo.memoize('clean_text', text, size)
+    # Not through clean_text(), which would cache the capitalized values once more under the keyword argument
+    clean_capitalized = memo.memoize('clean_capitalized', partial(text, capitalize=True), size)
+    normalize_name = memo.memoize('normalize_name', normalize_name, size)
+    normalize_fname = memo.memoize('normalize_fname', normalize_fname, size)
+    title = memo.memoize('title', title, size)
+    capwords = memo.memoize('capwords', capwords, size)
+    # Plans refer to the rules they were compiled with
+    clean_plans.clear()
+
+
+def clean_boolean(col):
+    return 'true' if _strip_cell(col) else 'false'
+
+
+def clean_year(col):
+    if col.isdigit() and col.isascii() and col != '0':
+        # Plain numbers are the most common values, nothing to fix in those except for short years, which
+        # _fix_year() counts itself
+        return _fix_year(col)
+    col = _strip_cell(col)
+    if col == '':
+        return col
+    return _fix_text(_fix_year(_fix_hidden(col)))
+
+
+def clean_text(col, capitalize=False):
+    if not col:
+        return col
+    if col.isdigit() and col.isascii():
+        # What _strip_cell() and _fix_money() would make of it, counted the same way
+        if col == '0':
+            instrument.count('clean.strip')
+            return ''
+        instrument.count('clean.money')
+        return '{}.00'.format(col)
+    col = _strip_cell(col)
+    if col == '':
+        return col
+    if capitalize:
+        col = col[0].upper() + col[1:]
+    return _fix_text(_fix_money(_fix_hidden(col)))
+
+
+def clean_capitalized(col):
+    return clean_text(col, capitalize=True)
+
+
+def compile_clean_plan(width):
+    """Pick a cleaning rule for each of the columns once instead of checking column lists for every cell"""
+    plan = []
+    for num in range(width):
+        if num in BOOLEAN_COLS:
+            plan.append(clean_boolean)
+        elif num in YEAR_COLS:
+            plan.append(clean_year)
+        elif num in CAPITALIZE_COLS:
+            plan.append(clean_capitalized)
+        else:
+            plan.append(clean_text)
+    return tuple(plan)
+
+
+clean_plans = {}  # Compiled plans by the row width
+
+
 def clean(row):
     """Fixing general issues with the data"""
-    cleaned_row = []
-    for num, col in enumerate(row):
-        col = col.replace('\n', ';')
-        col = re.sub(r'\s', ' ', col)
-        col = col.strip()
-        # Yeah, "Прочерк" it is...
-        if col in ('0', 'Прочерк', 'прочерк'):
-            col = ''
-        if not any(filter(lambda x: x not in ('-', '—'), col)):
-            col = ''
-        if num in BOOLEAN_COLS:
-            col = 'true' if len(col) > 0 else 'false'
-        elif col != '':
-            if num in CAPITALIZE_COLS:
-                col = col[0].upper() + col[1:]
-            # People put this in whatever way they want
-            col = re.sub(r'["(-\[]приховано[")-\]]', 'приховано', col, flags=re.I)
-            if col == 'Приховано':
-                col = 'приховано'
-
-            if num in YEAR_COLS and len(col) <= 10:
-                # Fix year values
-                col = ''.join(filter(lambda x: x.isdigit(), col))
-                if len(col) == 2:
-                    col = '20{}'.format(col)
-            else:
-                # Fix decimals
-                col = re.sub(r'грн?\.?$', '', col).rstrip()
-                if not any(filter(lambda x: not x.isdigit() and x not in (',', '.', ' '), col)) and ', ' not in col:
-                    # Remove spaces if it looks like a decimal without any other chars
-                    col = col.replace(' ', '')
-                col = re.sub(r'(\d+),(\d+)', r'\g<1>.\g<2>', col)
-                # Coerce money-looking decimals to a common format
-                col = re.sub(r'\d+\.\d{1,2}', lambda x: str(Decimal(x.group(0)).quantize(Decimal('.01'))), col)
-                if all(map(lambda x: x.isdigit(), col)):
-                    col = '{}.00'.format(col)
-
-            # Fix apostrophes
-            col = re.sub(r'([^a-zA-Z\d_])["\'`*]([^a-zA-Z\d_])', r'\g<1>’\g<2>', col)
-            # Fix Ukrainian "і"
-            col = re.sub(r'([^a-zA-Z\d_])[1i]([^a-zA-Z\d_])', r'\g<1>і\g<2>', col)
-        cleaned_row.append(col)
-
-    return cleaned_row
+    plan = clean_plans.get(len(row))
+    if plan is None:
+        plan = clean_plans[len(row)] = compile_clean_plan(len(row))
+    return [rule(col) for rule, col in zip(plan, row)]
 
 
 def normalize(row):
@@ -207,89 +601,188 @@ def normalize(row):
 
     normalized_row = row.copy()
 
-    normalized_row[COL_NAME] = string.capwords(row[COL_NAME])
+    normalized_row[COL_NAME] = capwords(row[COL_NAME])
     normalized_row[COL_FILENAME] = normalize_fname(row[COL_FILENAME])
 
     return normalized_row
 
 
-def augment(row, all_tasks, ambiguous_tasks, user_tasks):
-    """Add new helper columns to the dataset, e.g. hash and link to the original document"""
+def resolve_link(filename, email, all_tasks, user_tasks):
+    """Find the task for a filename, returns (link, score, margin, found_in_user_tasks) with an empty link if none"""
+    # Some users got planned tasks and beta tasks as well
+    # Beta tasks aren't represented in tasks.json
+    matches = []
+    if email in user_tasks:
+        matches = user_tasks[email].top(filename)
+    found_in_user_tasks = bool(matches)
+    if not matches:
+        # Use Jaro-Winkler distance to get the best similarity guess between the normalized manually entered filename
+        # and the value from tasks file normalized in the same way
+        matches = all_tasks.top(filename)
+    if not matches:
+        return '', None, None, found_in_user_tasks
+
+    score, link = matches[0]
+    return link, score, score - (matches[1][0] if len(matches) > 1 else 0), found_in_user_tasks
+
+
+def augment(row, all_tasks, ambiguous_tasks, user_tasks, link_cache=None):
+    """Add new helper columns to the dataset, e.g. hash and link to the original document
+
+    all_tasks is a TaskMatcher and user_tasks is a dict of them by email, see build_matchers()
+    """
     filename = row[COL_FILENAME]
 
     # Add some extra rows upfront
     row += [""] * 10
     row[COL_TASKNAME_IS_AMBIGUOS] = False
-    row[COL_NOT_FOUND_IN_USER_TASKS] = True
 
     name_fragments = list(map(title, normalize_name(row[COL_NAME]).split(" ")))
     row[COL_NAME_NORMALIZED] = " ".join(name_fragments[:3])
     row[COL_NAME_TROUBLESOME] = len(name_fragments) != 3
 
-    if row[COL_EMAIL] in user_tasks:
-        tasks = user_tasks[row[COL_EMAIL]]
-
-        # Some users got planned tasks and beta tasks as well
-        # Beta tasks aren't represented in tasks.json
-        if filename[:3] not in tasks:
-            tasks = all_tasks
-        else:
-            row[COL_NOT_FOUND_IN_USER_TASKS] = False
+    if link_cache is None:
+        resolution = resolve_link(filename, row[COL_EMAIL], all_tasks, user_tasks)
     else:
-        tasks = all_tasks
-
-    # Use prefix to narrow down the search space, 3 chars cause surnames (which are the filenames in the majority
-    # of cases, others being technical values) aren't likely to be less than this
-    if filename[:3] in tasks:
-        # Use Jaro-Winkler distance to get the best similarity guess between the normalized manually entered filename
-        # and the value from tasks file normalized in the same way
-        potential_links = map(lambda x: (Levenshtein.jaro_winkler(filename, x[0]), x[1]), tasks[filename[:3]])
-        row[COL_LINK] = max(potential_links)[1]
+        # Resolutions don't depend on the email of users without planned tasks so they share a single key
+        key = (row[COL_EMAIL] if row[COL_EMAIL] in user_tasks else '', filename)
+        resolution = link_cache.get(key)
+        if resolution is None:
+            resolution = resolve_link(filename, row[COL_EMAIL], all_tasks, user_tasks)
+            link_cache.put(key, resolution)
+
+    link, score, margin, found_in_user_tasks = resolution
+    # Counted by the resolution rather than in resolve_link(), so the rows resolved from the cache are counted too
+    if row[COL_EMAIL] not in user_tasks:
+        instrument.count('augment.no_user_tasks')
+    elif not found_in_user_tasks:
+        instrument.count('augment.user_tasks_fallback')
+    if not link:
+        instrument.count('augment.not_found')
+    row[COL_NOT_FOUND_IN_USER_TASKS] = not found_in_user_tasks
+    if link:
+        row[COL_LINK], row[COL_LINK_SCORE], row[COL_LINK_MARGIN] = link, score, margin
     elif len(row[COL_NAME]) < 10:
-        # If no prefix match just skip it entirely, it's most likely not a real filename
+        # If there is nothing similar just skip it entirely, it's most likely not a real filename
         raise ValidationError
 
     if ambiguous_tasks[os.path.basename(row[COL_LINK])] > 1:
         row[COL_TASKNAME_IS_AMBIGUOS] = True
 
     # A helper column for a simple hash-based deduplication attempt
-    hashable_string = ':'.join((str(c) for i, c in enumerate(row) if i not in (NON_HASHABLE_COLS + USELESS_COLS)))
-    row[COL_HASH] = md5(hashable_string.encode('utf-8')).hexdigest()
+    row[COL_HASH] = row_hash(row)
 
     return row
 
 
-def deduplicate(data):
-    """Use hash to try and find complete matches in the dataset"""
+def hashable_columns(width):
+    """Columns of a row of the width that go into its hash, all but NON_HASHABLE_COLS and USELESS_COLS"""
+    excluded = frozenset(NON_HASHABLE_COLS + USELESS_COLS)
+    return tuple(i for i in range(width) if i not in excluded)
+
+
+hash_projections = {}  # Getters of the hashable values by the row width
+
+
+def row_hash(row):
+    project = hash_projections.get(len(row))
+    if project is None:
+        project = hash_projections[len(row)] = itemgetter(*hashable_columns(len(row)))
+    hashable_string = ':'.join(map(str, project(row)))
+    return blake2b(hashable_string.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def deduplicate(data, memory_budget=MEMORY_BUDGET):
+    """Use hash to try and find complete matches in the dataset, returns the first of every hash in the hash order
+
+    An iterator of rows is sorted on disk beyond the memory budget and the rows are collected into a ColumnStore.
+    """
     print('Deduplicating data...')
-    # Probably not the most efficient way but works fast enough for a small (few thousands) dataset
+    if hasattr(data, '__len__'):
+        # Rows are in memory already, so only the hashes are sorted and rows are taken by their positions
+        hashes = column(data, COL_HASH)
+        ordered = ((hashes[num], data[num]) for num in argsort(hashes))
+        deduped_data = []
+    else:
+        ordered = sort_by_column(data, COL_HASH, memory_budget)
+        deduped_data = ColumnStore()
     prev_hash = ''
-    deduped_data = []
-    data.sort(key=lambda x: x[COL_HASH])
-    for row in data:
-        if row[COL_HASH] != prev_hash:
-            prev_hash = row[COL_HASH]
+    for key, row in ordered:
+        if key != prev_hash:
+            prev_hash = key
             deduped_data.append(row)
+    if isinstance(deduped_data, ColumnStore):
+        deduped_data.freeze()
     print('Rows after deduplication: {}'.format(len(deduped_data)))
 
     return deduped_data
 
 
+def merge_near_duplicates(data, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """Collapse rows which differ only in a few of the hashable columns into one"""
+    print('Merging near duplicates...')
+    width = max((len(row) for row in data), default=0)
+    clusters = find_near_duplicates(data, hashable_columns(width), threshold)
+    merged_data = [merge_rows([data[i] for i in cluster]) for cluster in clusters]
+    print('Rows after merging near duplicates: {}'.format(len(merged_data)))
+
+    return merged_data
+
+
 def merge_rows(rows):
-    pass
+    """Consolidate a group of duplicates into a single row taking the most common non-empty value of each column"""
+    if len(rows) == 1:
+        return rows[0]
+
+    merged_row = []
+    for values in zip(*rows):
+        counts = Counter(value for value in values if value != '')
+        # Counter keeps the order of insertion so ties go to the value of the first row
+        merged_row.append(counts.most_common(1)[0][0] if counts else '')
+
+    if len(merged_row) > COL_HASH:
+        merged_row[COL_HASH] = row_hash(merged_row)
+    return merged_row
+
+
+def add_arguments(parser):
+    """Options of process_source() and of the rules, for the scripts running it"""
+    parser.add_argument('--link-cache', metavar='FILENAME',
+                        help='SQLite file to keep filename to link resolutions in between the runs')
+    parser.add_argument('--incremental', metavar='MANIFEST',
+                        help='Manifest file of the previous run, only new or changed rows are processed')
+    parser.add_argument('--seen-index', metavar='FILENAME',
+                        help='SQLite file with the hashes of the rows written by the earlier runs, which are dropped')
+    parser.add_argument('--task-index', metavar='FILENAME',
+                        help='Compiled task lists to map instead of parsing them, rebuilt if the lists have changed')
+    parser.add_argument('--memo-size', type=int, default=memo.MEMO_SIZE, metavar='VALUES',
+                        help='Number of the latest cleaned and normalized values of every kind to cache, 0 to disable')
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 4:
-        sys.exit('Usage: {} source-filename tasks-filename user-tasks-filename'.format(sys.argv[0]))
-    source_filename = sys.argv[1]
-    if not os.path.exists(source_filename):
-        sys.exit('File "{}" does not exist'.format(source_filename))
-    tasks_filename = sys.argv[2]
-    if not os.path.exists(tasks_filename):
-        sys.exit('File "{}" does not exist'.format(tasks_filename))
-    user_tasks_filename = sys.argv[3]
-    if not os.path.exists(user_tasks_filename):
-        sys.exit('File "{}" does not exist'.format(user_tasks_filename))
-
-    process_source(source_filename, tasks_filename, user_tasks_filename)
+    parser = argparse.ArgumentParser(description='Clean and augment raw results')
+    parser.add_argument('source_filename')
+    parser.add_argument('tasks_filename')
+    parser.add_argument('user_tasks_filename')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes to clean and augment the rows with')
+    parser.add_argument('--output-format', choices=('csv', 'csv.gz', 'csv.zst', 'col'), default='csv',
+                        help='Write results as CSV, compressed CSV or in the binary columnar format for the other '
+                             'scripts, columnar results are kept in memory until all rows are processed')
+    add_arguments(parser)
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    for filename in (args.source_filename, args.tasks_filename, args.user_tasks_filename):
+        if not os.path.exists(filename):
+            sys.exit('File "{}" does not exist'.format(filename))
+
+    if args.profile:
+        instrument.enable(args.profile, args.cprofile)
+        count_clean_rules()
+    if args.memo_size:
+        memoize_rules(args.memo_size)
+
+    process_source(args.source_filename, args.tasks_filename, args.user_tasks_filename, args.workers,
+                   args.link_cache, args.incremental, args.output_format, args.task_index, args.seen_index)
+    instrument.save('fix.py')
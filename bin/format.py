@@ -1,12 +1,20 @@
 import sys
 import os
 import re
-import csv
+import json
+import argparse
+import multiprocessing
 
 import xlsxwriter
+import fileio
+import instrument
 
 from itertools import groupby
 from datetime import datetime
+from operator import itemgetter
+from extsort import sort_by_column, MEMORY_BUDGET
+from rowstore import ColumnStore, argsort, column
+from columnar import is_columnar, load as load_columnar
 
 
 COL_FILENAME = 1  # "Filename" column number
@@ -15,120 +23,269 @@ NUM_SHEETS = 10  # Default number of worksheets to spread the groups on
 HIGHLIGHT_COLS = (2, 3) + tuple(range(5, 311))
 
 
-def load_source(filename):
+def load_source(filename, lazy_values=False):
+    if is_columnar(filename):
+        # Columns are mapped and decoded only when something needs them
+        return load_columnar(filename, lazy_values)
+
     header = None
-    data = []
-    with open(filename, 'r', newline='', encoding='utf-8') as source:
+    with fileio.reading(filename) as reader:
         print('Reading the file "{}"'.format(filename))
-        reader = csv.reader(source)
         header = next(reader)  # skip the header but store for later usage
         print('Loading rows...')
-        for row in reader:
-            data.append(row)
+        data = ColumnStore()
+        data.extend(reader)
+        data.freeze()
         print('Loaded rows: {}'.format(len(data)))
 
     return header, data
 
 
-def group_by_link(data):
-    """Group the records by a link value and return as a dict with link being a key"""
+def group_by_link(data, memory_budget=MEMORY_BUDGET):
+    """Group the records by a link value and return as a dict with link being a key
+
+    An iterator of rows is sorted on disk beyond the memory budget and the rows of the groups are collected into
+    a ColumnStore.
+    """
     print('Grouping the data...')
     grouped_data = {}
-    sorted_data = sorted(data, key=lambda x: x[COL_LINK])
-    for key, group in groupby(sorted_data, key=lambda x: x[COL_LINK]):
-        row_data = list(group)
-        # Filter groups that have only one record
+    if hasattr(data, '__len__'):
+        # Rows are in memory already, so only the links are sorted and rows are taken by their positions
+        links = column(data, COL_LINK)
+        for key, group in groupby(argsort(links), key=links.__getitem__):
+            row_data = [data[num] for num in group]
+            # Filter groups that have only one record
+            if len(row_data) > 1:
+                grouped_data[key] = row_data
+        return grouped_data
+
+    store = ColumnStore()
+    for key, group in groupby(sort_by_column(data, COL_LINK, memory_budget), key=itemgetter(0)):
+        row_data = [row for _, row in group]
         if len(row_data) > 1:
-            grouped_data[key] = row_data
+            first = len(store)
+            store.extend(row_data)
+            grouped_data[key] = store[first:]
+    store.freeze()
 
     return grouped_data
 
 
-def write_result(header, grouped_data_items, num_sheets, highlight_cols=None):
-    """Format and write data to an XLSX with pagination"""
+def header_group_starts(header):
+    """Flags of the columns which start a new group of columns, judging by the number in front of the header"""
+    starts = []
+    prev_group = ""
+    for title in header:
+        m = re.match(r"(\d+)", title)
+        if m and m.group(1) == prev_group:
+            starts.append(False)
+        else:
+            if m:
+                prev_group = m.group(1)
+            starts.append(True)
+    return starts
 
-    header = ["Номер групи"] + header
-    if highlight_cols is None:
-        highlight_cols = []
 
-    filename = 'formatted_{:%Y-%m-%d_%H:%M:%S}.xlsx'.format(datetime.now())
-    print('Writing to XLSX workbook "{}"'.format(filename))
-    workbook = xlsxwriter.Workbook(filename)
+def mismatched_cols(rows, highlight_cols):
+    """Columns among highlight_cols that don't have the same value in all of the rows"""
+    width = min(len(row) for row in rows)
+    return frozenset(col for col in highlight_cols if col < width and len({row[col] for row in rows}) > 1)
+
+
+class FormatCache(object):
+    """There are only a dozen cell formats in the result, so each of them is added to the workbook once"""
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.formats = {}
 
-    groups_per_sheet = len(grouped_data_items) // num_sheets
+    def get(self, mismatch, new_group_started, edge):
+        key = (mismatch, new_group_started, edge)
+        format = self.formats.get(key)
+        if format is None:
+            format = self.formats[key] = self.workbook.add_format()
+            # Highlight columns that contain non-matching cells
+            if mismatch:
+                format.set_bg_color('red')
+            # Handle the group borders
+            format.set_border_color('#DDDDDD')
+            format.set_border(1)
+            if new_group_started:
+                format.set_left_color('black')
+            if edge == 'top':
+                format.set_top_color('black')
+            elif edge == 'bottom':
+                format.set_bottom_color('black')
+        return format
+
+
+def page_bounds(num_groups, num_sheets):
+    """Pagination bounds of the groups for every sheet, the last one gets the remainder"""
+    groups_per_sheet = num_groups // num_sheets
+    bounds = []
     for sheet_num in range(num_sheets):
-        worksheet = workbook.add_worksheet('Book{}'.format(sheet_num + 1))
-        # Pagination bounds
         lower_bound = groups_per_sheet * sheet_num
         if sheet_num == num_sheets - 1:
-            upper_bound = None
+            upper_bound = num_groups
         else:
             upper_bound = groups_per_sheet * (sheet_num + 1)
-        sheet_groups = grouped_data_items[lower_bound:upper_bound]
-
-        row_pointer = 0  # Current row in the worksheet
-        worksheet.write_row(row_pointer, 0, header)
-        for group_num, rows in enumerate(sheet_groups):
-            for row_num, row in enumerate(rows):
-                row_pointer += 1
-                prev_group = ""
-
-                for col, cell in enumerate([group_num] + row):
-                    # Here we are using number in front of header of current
-                    # column to determine if we are still in the same group
-                    new_group_started = True
-                    if len(header) > col:
-                        m = re.match("(\d+)", header[col])
-                        if m:
-                            if m.group(1) == prev_group:
-                                new_group_started = False
-                            else:
-                                prev_group = m.group(1)
-
-                    orig_col = col - 1
-                    format = workbook.add_format()
-                    # Highlight columns that contain non-matching cells
-                    if orig_col in highlight_cols:
-                        if any([x[orig_col] != cell for i, x in enumerate(rows) if i != row_num]):
-                            format.set_bg_color('red')
-                    # Handle the group borders
-                    format.set_border_color('#DDDDDD')
-                    format.set_border(1)
-
-                    if new_group_started:
-                        format.set_left_color('black')
-
-                    if row_num == 0:
-                        format.set_top_color('black')
-                    elif row_num == len(rows) - 1:
-                        format.set_bottom_color('black')
-
-                    # Filenames might sometimes be detected as numbers and we don't want this
-                    if col == COL_FILENAME:
-                        worksheet.write_string(row_pointer, col, cell, format)
-                    else:
-                        worksheet.write(row_pointer, col, cell, format)
-
-            # Disabled for now
-            # # Add an empty row between the groups
-            # row_pointer += 1
-            # worksheet.write_row(row_pointer, 0, [])
-        print('Wrote {} rows for sheet {}'.format(row_pointer + 1, sheet_num))
+        bounds.append((lower_bound, upper_bound))
+    return bounds
+
+
+def write_sheet(worksheet, formats, header, sheet_groups, highlight_cols, first_group_num=0):
+    """Write the groups of a single page to the worksheet, returns the number of rows written"""
+    # Here we are using number in front of header of current column to determine if we are still in the same group
+    group_starts = header_group_starts(header)
+
+    row_pointer = 0  # Current row in the worksheet
+    worksheet.write_row(row_pointer, 0, header)
+    for group_num, rows in enumerate(sheet_groups, first_group_num):
+        if not rows:
+            continue
+        mismatches = mismatched_cols(rows, highlight_cols)
+        for row_num, row in enumerate(rows):
+            row_pointer += 1
+
+            edge = None
+            if row_num == 0:
+                edge = 'top'
+            elif row_num == len(rows) - 1:
+                edge = 'bottom'
+
+            for col, cell in enumerate([group_num] + list(row)):
+                new_group_started = col >= len(group_starts) or group_starts[col]
+                format = formats.get(col - 1 in mismatches, new_group_started, edge)
+
+                # Filenames might sometimes be detected as numbers and we don't want this
+                if col == COL_FILENAME:
+                    worksheet.write_string(row_pointer, col, cell, format)
+                else:
+                    worksheet.write(row_pointer, col, cell, format)
+
+        # Disabled for now
+        # # Add an empty row between the groups
+        # row_pointer += 1
+        # worksheet.write_row(row_pointer, 0, [])
+    return row_pointer + 1
+
+
+def write_result(header, grouped_data_items, num_sheets, highlight_cols=None, prefix='formatted'):
+    """Format and write data to an XLSX with pagination, returns the filename"""
+
+    header = ["Номер групи"] + header
+    if highlight_cols is None:
+        highlight_cols = []
 
+    filename = '{}_{:%Y-%m-%d_%H:%M:%S}.xlsx'.format(prefix, datetime.now())
+    print('Writing to XLSX workbook "{}"'.format(filename))
+    # Rows are written strictly in order, so they can be flushed to disk right away
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    formats = FormatCache(workbook)
+
+    for sheet_num, (lower_bound, upper_bound) in enumerate(page_bounds(len(grouped_data_items), num_sheets)):
+        worksheet = workbook.add_worksheet('Book{}'.format(sheet_num + 1))
+        num_rows = write_sheet(worksheet, formats, header, grouped_data_items[lower_bound:upper_bound], highlight_cols)
+        print('Wrote {} rows for sheet {}'.format(num_rows, sheet_num))
+
+    workbook.close()
+    return filename
+
+
+shard_data = None  # Header, groups and highlighted columns of a worker process
+
+
+def init_shard_worker(header, grouped_data_items, highlight_cols):
+    global shard_data
+    shard_data = (header, grouped_data_items, highlight_cols)
+
+
+def write_shard(filename, sheet_num, lower_bound, upper_bound):
+    header, grouped_data_items, highlight_cols = shard_data
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Book{}'.format(sheet_num + 1))
+    num_rows = write_sheet(worksheet, FormatCache(workbook), header, grouped_data_items[lower_bound:upper_bound],
+                           highlight_cols)
     workbook.close()
+    print('Wrote {} rows to "{}"'.format(num_rows, filename))
+    return num_rows
+
+
+def write_sharded_result(header, grouped_data_items, num_sheets, highlight_cols=None, workers=None,
+                         prefix='formatted'):
+    """Same as write_result() but every page goes to its own XLSX, written by a pool of processes
+
+    A JSON manifest with the range of groups in each of the files is written next to them, its filename is returned.
+    """
+    header = ["Номер групи"] + header
+    if highlight_cols is None:
+        highlight_cols = []
+
+    prefix = '{}_{:%Y-%m-%d_%H:%M:%S}'.format(prefix, datetime.now())
+    shards = [('{}_{}.xlsx'.format(prefix, sheet_num + 1), sheet_num, lower_bound, upper_bound)
+              for sheet_num, (lower_bound, upper_bound)
+              in enumerate(page_bounds(len(grouped_data_items), num_sheets))]
+    print('Writing {} XLSX workbooks "{}_*.xlsx"'.format(len(shards), prefix))
+
+    # Shards only name their bounds, the groups themselves reach each worker once through the initializer
+    with multiprocessing.Pool(workers, initializer=init_shard_worker,
+                              initargs=(header, grouped_data_items, highlight_cols)) as pool:
+        num_rows = pool.starmap(write_shard, shards)
+
+    manifest_filename = '{}_manifest.json'.format(prefix)
+    with open(manifest_filename, 'w', encoding='utf-8') as manifest:
+        # Pages past the last group are empty, there are no groups to tell the range of
+        json.dump([{'filename': filename, 'sheet': 'Book{}'.format(sheet_num + 1),
+                    'first_group': lower_bound if upper_bound > lower_bound else None,
+                    'last_group': upper_bound - 1 if upper_bound > lower_bound else None, 'rows': rows}
+                   for (filename, sheet_num, lower_bound, upper_bound), rows in zip(shards, num_rows)],
+                  manifest, ensure_ascii=False, indent=2)
+    print('Manifest was written to: {}'.format(manifest_filename))
+    return manifest_filename
+
+
+def add_arguments(parser):
+    parser.add_argument('--shards', action='store_true', help='Write every sheet to its own XLSX file in parallel')
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        sys.exit('Usage: {} source-filename <num-sheets>'.format(sys.argv[0]))
-    source_filename = sys.argv[1]
-    if not os.path.exists(source_filename):
-        sys.exit('File "{}" does not exist'.format(source_filename))
-    num_sheets = NUM_SHEETS
-    if len(sys.argv) == 3:
-        num_sheets = int(sys.argv[2])
-
-    header, data = load_source(source_filename)
-    grouped_data = group_by_link(data)
-    write_result(header, list(grouped_data.items()), num_sheets,
-                 HIGHLIGHT_COLS)
+    parser = argparse.ArgumentParser(description='Group the rows by link and write them to XLSX for review')
+    parser.add_argument('source_filename')
+    parser.add_argument('num_sheets', nargs='?', type=int, default=NUM_SHEETS)
+    add_arguments(parser)
+    parser.add_argument('--workers', type=int, help='Number of processes to write the shards with')
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET // (1024 * 1024), metavar='MB',
+                        help='Files larger than that are streamed and grouped on disk')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source_filename):
+        sys.exit('File "{}" does not exist'.format(args.source_filename))
+
+    if args.profile:
+        instrument.enable(args.profile, args.cprofile)
+
+    memory_budget = args.memory_budget * 1024 * 1024
+    source_size = fileio.data_size(args.source_filename, os.path.getsize(args.source_filename))
+    if is_columnar(args.source_filename) or source_size <= memory_budget:
+        with instrument.stage('load_source') as stage:
+            header, data = load_source(args.source_filename)
+            stage.rows = num_rows = len(data)
+        with instrument.stage('group') as stage:
+            grouped_data = group_by_link(data)
+            stage.rows = num_rows
+    else:
+        # Too large to be loaded, rows are sorted by the link on disk straight from the file
+        with instrument.stage('group') as stage, fileio.reading(args.source_filename) as reader:
+            print('Reading the file "{}"'.format(args.source_filename))
+            header = next(reader)
+            grouped_data = group_by_link(reader, memory_budget)
+            stage.rows = num_rows = reader.rows
+
+    with instrument.stage('write_result') as stage:
+        if args.shards:
+            write_sharded_result(header, list(grouped_data.values()), args.num_sheets, HIGHLIGHT_COLS, args.workers)
+        else:
+            write_result(header, list(grouped_data.values()), args.num_sheets, HIGHLIGHT_COLS)
+        stage.rows = num_rows
+    instrument.save('format.py')
@@ -1,10 +1,17 @@
 import sys
 import os
-import csv
+import argparse
 
-from collections import Counter, defaultdict
-from format import write_result, load_source
-from itertools import groupby
+import fileio
+import format
+import instrument
+
+from collections import Counter
+from columnar import is_columnar, Writer as ColumnarWriter
+from format import write_result, write_sharded_result, load_source
+from namematch import match_names
+from rowstore import column, width
+from unionfind import UnionFind
 
 DEBUG_COL_FILENAME = 0  # "Filename" column number
 DEBUG_COL_EMAIL = 1
@@ -18,74 +25,154 @@ DEBUG_COL_NAME_TROUBLESOME = 7
 COL_FILENAME = 1  # "Filename" column number
 COL_LINK = 312  # Link to the original document
 COL_NAME_NORMALIZED = 313
+CONFIDENCE_TITLE = 'Впевненість збігу ПІБ'  # Confidence of the name match, added to the output
 
 
 def save_intermediate_results(filename, data):
-    with open(filename, 'w', newline='', encoding='utf-8') as dest:
-        writer = csv.writer(dest)
+    if is_columnar(filename):
+        writer = ColumnarWriter(filename)
+        writer.writerows(data)
+        writer.close()
+        return
 
-        for row in data:
-            writer.writerow(row)
+    with fileio.BackgroundWriter(filename) as writer:
+        writer.writerows(data)
 
 
-def group_by_link_and_name(data):
-    print('Grouping the data...')
+class ScoredRow(object):
+    """Row padded to the width of the data, with the confidence of its name match as one more column"""
+    __slots__ = ('row', 'width', 'confidence')
 
-    grouper = Counter()
-    grouper.update(d[COL_NAME_NORMALIZED] for d in data)
+    def __init__(self, row, width, confidence):
+        self.row = row
+        self.width = width
+        self.confidence = confidence
 
-    first_pass = defaultdict(list)
-    not_used = []
-    orphans = []
+    def __len__(self):
+        return self.width + 1
 
-    # Grouping by normalized name first.
-    for d in data:
-        name = d[COL_NAME_NORMALIZED]
-        if name and grouper[name] > 1:
-            first_pass[name].append(d)
-        else:
-            not_used.append(d)
-
-    print("{} rows was matched into {} groups on a first pass".format(len(data) - len(not_used), len(first_pass.keys())))
-    print("{} rows wasn't matched by name. Trying to match them by links to existing groups...".format(len(not_used)))
-
-    # Attaching then the rest by matching their urls to urls of groups
-    # created on previous stage
-    for d in not_used:
-        for k, d2 in first_pass.items():
-            if d[COL_LINK] and d[COL_LINK] in [x[COL_LINK] for x in d2]:
-                first_pass[k].append(d)
-                break
-        else:
-            orphans.append(d)
+    def __getitem__(self, col):
+        if col == self.width:
+            return self.confidence
+        return self.row[col] if col < len(self.row) else ''
+
+    def __iter__(self):
+        yield from self.row
+        for _ in range(len(self.row), self.width):
+            yield ''
+        yield self.confidence
+
+
+def group_by_link_and_name(data, fuzzy=True):
+    """Group rows connected either by the same normalized name or by the same link, transitively
 
-    print("{} rows wasn't matched by link to existing groups".format(len(orphans)))
+    With fuzzy set, names that are only similar connect the rows as well, see namematch.py. Rows are returned as
+    ScoredRow with the confidence of the name match: 1 for the same names, the similarity of the names for the
+    similar ones and empty for the rows grouped by links only.
+    """
+    print('Grouping the data...')
 
-    second_pass = []
-    # Grouping the final chunk of unmatched data by urls
-    sorted_data = sorted(orphans, key=lambda x: x[COL_LINK])
+    # Only the two key columns are scanned, rows themselves are taken by their positions
+    names = column(data, COL_NAME_NORMALIZED)
+    links = column(data, COL_LINK)
+    grouper = Counter()
+    grouper.update(names)
+
+    groups = UnionFind(len(data))
+    first_by_name = {}
+    first_by_link = {}  # Inverted index from a link to the first row with it, and so to its group
+    matched_by_name = [False] * len(data)
+
+    for num, (name, link) in enumerate(zip(names, links)):
+        if name:
+            first_num = first_by_name.setdefault(name, num)
+            if grouper[name] > 1:
+                matched_by_name[num] = True
+                groups.union(first_num, num)
+        if link:
+            groups.union(first_by_link.setdefault(link, num), num)
+
+    scores = {}  # Best similarity of a name to the other names it was matched with
+    if fuzzy:
+        distinct_names = list(first_by_name)
+        first_nums = list(first_by_name.values())
+        for a, b, score in match_names(distinct_names,
+                                       connected=lambda a, b: groups.find(first_nums[a]) == groups.find(first_nums[b])):
+            groups.union(first_nums[a], first_nums[b])
+            for name in (distinct_names[a], distinct_names[b]):
+                scores[name] = max(score, scores.get(name, 0))
+        print('{} names were matched to similar ones'.format(len(scores)))
+
+    confidence = [''] * len(data)
+    for num, name in enumerate(names):
+        if matched_by_name[num]:
+            confidence[num] = 1.0
+        elif name in scores:
+            matched_by_name[num] = True
+            confidence[num] = round(scores[name], 3)
+
+    data_width = width(data)
+    name_groups = []
+    link_groups = []
     stupid_orphans = []
-    for key, group in groupby(sorted_data, key=lambda x: x[COL_LINK]):
-        if not key:
-            stupid_orphans = list(group)
+    for group in groups.groups():
+        if any(matched_by_name[num] for num in group):
+            name_groups.append([ScoredRow(data[num], data_width, confidence[num]) for num in group])
+        elif links[group[0]]:
+            link_groups.append([ScoredRow(data[num], data_width, confidence[num]) for num in group])
         else:
-            second_pass.append(list(group))
+            stupid_orphans.append(ScoredRow(data[group[0]], data_width, confidence[group[0]]))
 
-    print("So we've grouped them by links only into {} groups".format(len(second_pass)))
+    print("{} rows was matched into {} groups by name and links".format(
+        sum(len(group) for group in name_groups), len(name_groups)))
+
+    # The rest got no name matches, so they are grouped by links only
+    link_groups.sort(key=lambda x: x[0][COL_LINK])
+    print("So we've grouped them by links only into {} groups".format(len(link_groups)))
 
     print("{} has no link and also cannot be matched by name".format(len(stupid_orphans)))
-    print("{} groups was created".format(len(first_pass.keys()) + len(second_pass) + 1))
-    return list(first_pass.values()) + second_pass + [stupid_orphans]
+    print("{} groups was created".format(len(name_groups) + len(link_groups) + 1))
+    return name_groups + link_groups + [stupid_orphans]
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 1:
-        sys.exit('Usage: {} source-filename'.format(sys.argv[0]))
-    source_filename = sys.argv[1]
-    if not os.path.exists(source_filename):
-        sys.exit('File "{}" does not exist'.format(source_filename))
+def output_header(header, data):
+    """Header of the grouped rows, padded to their width and with the confidence column"""
+    return header + [''] * (width(data) - len(header)) + [CONFIDENCE_TITLE]
 
-    header, data = load_source(source_filename)
-    grouped_data = group_by_link_and_name(data)
 
-    write_result(header, grouped_data, 1, [COL_NAME_NORMALIZED])
+def add_arguments(parser):
+    parser.add_argument('--exact-names', action='store_true',
+                        help='Only group the rows with the same normalized names, not the similar ones')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Group the rows by name and link and write them to XLSX for review')
+    parser.add_argument('source_filename')
+    parser.add_argument('num_sheets', nargs='?', type=int, default=1)
+    format.add_arguments(parser)
+    parser.add_argument('--workers', type=int, help='Number of processes to write the shards with')
+    add_arguments(parser)
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source_filename):
+        sys.exit('File "{}" does not exist'.format(args.source_filename))
+
+    if args.profile:
+        instrument.enable(args.profile, args.cprofile)
+
+    with instrument.stage('load_source') as stage:
+        header, data = load_source(args.source_filename)
+        stage.rows = len(data)
+    with instrument.stage('group') as stage:
+        grouped_data = group_by_link_and_name(data, not args.exact_names)
+        header = output_header(header, data)
+        stage.rows = len(data)
+
+    with instrument.stage('write_result') as stage:
+        if args.shards:
+            write_sharded_result(header, grouped_data, args.num_sheets, [COL_NAME_NORMALIZED], args.workers)
+        else:
+            write_result(header, grouped_data, args.num_sheets, [COL_NAME_NORMALIZED])
+        stage.rows = len(data)
+    instrument.save('group.py')
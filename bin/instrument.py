@@ -0,0 +1,160 @@
+"""Per-stage timings and counters of a run, written out as a JSON report if enable() was called"""
+import os
+import sys
+import json
+import time
+import cProfile
+import resource
+
+from collections import Counter
+from contextlib import contextmanager
+
+report_filename = None
+profile_dir = None
+stages = []
+running = []  # Names of the stages which are being measured, innermost last
+counters = Counter()
+files = []
+
+
+class Stage(object):
+    """Whatever a stage wants to add to its entry of the report, rows is the number of processed rows"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+
+
+dummy_stage = Stage(None)
+
+
+def enable(filename, cprofile_dir=None):
+    """Start collecting the report to be written to the filename, cProfile stats of the stages go to cprofile_dir"""
+    global report_filename, profile_dir
+    report_filename = filename
+    profile_dir = cprofile_dir
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+
+def add_arguments(parser):
+    parser.add_argument('--profile', metavar='REPORT',
+                        help='Write timings, peak memory and counters of the stages to the JSON file')
+    parser.add_argument('--cprofile', metavar='DIR', help='Also dump cProfile stats of every stage to the directory')
+
+
+def enabled():
+    return report_filename is not None
+
+
+def peak_rss():
+    """Peak resident set size of the process and of its finished children so far, in KiB
+
+    It's the high-water mark since the start of the process rather than the peak of the current stage, so a stage
+    only shows its own peak if it went above the ones of all earlier stages.
+    """
+    # Linux reports ru_maxrss in KiB and macOS in bytes
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+
+@contextmanager
+def stage(name):
+    """Measure the block as a stage of the run, set .rows of the yielded Stage to get the throughput"""
+    if report_filename is None:
+        yield dummy_stage
+        return
+
+    current = Stage(name)
+    profiler = None
+    if profile_dir and not running:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    children_started = os.times()
+    parent = running[-1] if running else None
+    running.append(name)
+    try:
+        yield current
+    finally:
+        running.pop()
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        children = os.times()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile_dir, '{}.{}.prof'.format(len(stages), name)))
+        rss, children_rss = peak_rss()
+        entry = {
+            'name': name,
+            'wall_seconds': round(wall, 4),
+            'cpu_seconds': round(cpu, 4),
+            # Worker processes are only accounted for once they have exited
+            'children_cpu_seconds': round(children.children_user + children.children_system
+                                          - children_started.children_user - children_started.children_system, 4),
+            # Peak since the start of the run up to the end of the stage, see peak_rss()
+            'peak_rss_so_far_kb': rss,
+            'children_peak_rss_so_far_kb': children_rss,
+        }
+        if parent is not None:
+            entry['parent'] = parent
+        if current.rows is not None:
+            entry['rows'] = current.rows
+            entry['rows_per_second'] = round(current.rows / wall) if wall else None
+        stages.append(entry)
+
+
+def count(name, n=1):
+    if report_filename is not None:
+        counters[name] += n
+
+
+def counted(name, func):
+    """Wrap a function of a single value to count the calls that changed it under the name"""
+    def wrapper(value, *args, **kwargs):
+        result = func(value, *args, **kwargs)
+        if result != value:
+            counters[name] += 1
+        return result
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def add_file(filename, action, rows, seconds):
+    """Throughput of a file read or written by the run"""
+    if report_filename is not None:
+        files.append({'filename': filename, 'action': action, 'rows': rows, 'seconds': round(seconds, 4),
+                      'rows_per_second': round(rows / seconds) if seconds else None})
+
+
+def take_counters():
+    """Counters collected since the last call, for worker processes to send them over to the parent"""
+    taken = Counter(counters)
+    counters.clear()
+    return taken
+
+
+def add_counters(taken):
+    counters.update(taken)
+
+
+def save(script):
+    """Write the report if it was enabled"""
+    if report_filename is None:
+        return
+    report = {
+        'script': script,
+        'argv': sys.argv,
+        'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': stages,
+        'total_wall_seconds': round(sum(entry['wall_seconds'] for entry in stages if 'parent' not in entry), 4),
+        'peak_rss_kb': max(peak_rss()),
+        'counters': dict(sorted(counters.items())),
+        'files': files,
+    }
+    with open(report_filename, 'w') as dest:
+        json.dump(report, dest, indent=2, ensure_ascii=False)
+    print('Run report was written to: {}'.format(report_filename))
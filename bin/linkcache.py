@@ -0,0 +1,91 @@
+"""On-disk cache of filename to link resolutions, shared between the runs over the same tasks files"""
+import sqlite3
+
+from hashlib import md5
+
+import matcher
+
+
+def files_digest(*filenames):
+    """Hash of the files content together with the matcher settings, changes whenever a resolution might change"""
+    digest = md5('{}:{}:{}'.format(matcher.NGRAM_SIZE, matcher.MAX_EDITS, matcher.MIN_SCORE).encode('utf-8'))
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LinkCache(object):
+    """Resolutions of (email, normalized filename) for a single tasks digest
+
+    The entries are loaded into memory upfront and new ones are only written on save(), so copies of the cache
+    can be used in the worker processes with their updates passed back through take_updates()/add_updates().
+    """
+
+    def __init__(self, filename, digest):
+        self.filename = filename
+        self.digest = digest
+        self.entries = {}
+        self.new_entries = {}
+        self.hits = 0
+        self.misses = 0
+
+        conn = self.connect()
+        with conn:
+            for email, fname, link, score, margin, found_in_user_tasks in conn.execute(
+                    'SELECT email, filename, link, score, margin, found_in_user_tasks FROM links WHERE digest = ?',
+                    (digest,)):
+                self.entries[(email, fname)] = (link, score, margin, bool(found_in_user_tasks))
+        conn.close()
+        print('Loaded {} cached links from "{}"'.format(len(self.entries), filename))
+
+    def connect(self):
+        conn = sqlite3.connect(self.filename)
+        conn.execute('CREATE TABLE IF NOT EXISTS links (digest TEXT, email TEXT, filename TEXT, link TEXT, '
+                     'score REAL, margin REAL, found_in_user_tasks INTEGER, PRIMARY KEY (digest, email, filename))')
+        return conn
+
+    def get(self, key):
+        resolution = self.entries.get(key)
+        if resolution is None:
+            resolution = self.new_entries.get(key)
+        if resolution is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return resolution
+
+    def put(self, key, resolution):
+        self.new_entries[key] = resolution
+
+    def take_updates(self):
+        """New entries and counters collected since the last call, resets them
+
+        Taken entries are still found by get(), so a worker doesn't resolve a filename of its earlier chunks again.
+        """
+        updates = (self.new_entries, self.hits, self.misses)
+        self.entries.update(self.new_entries)
+        self.new_entries = {}
+        self.hits = self.misses = 0
+        return updates
+
+    def add_updates(self, updates):
+        new_entries, hits, misses = updates
+        self.new_entries.update(new_entries)
+        self.hits += hits
+        self.misses += misses
+
+    def save(self):
+        conn = self.connect()
+        with conn:
+            # Resolutions made against other versions of the tasks files are of no use anymore
+            conn.execute('DELETE FROM links WHERE digest != ?', (self.digest,))
+            conn.executemany(
+                'INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((self.digest, email, fname, link, score, margin, found_in_user_tasks)
+                 for (email, fname), (link, score, margin, found_in_user_tasks) in self.new_entries.items()))
+        conn.close()
+        self.entries.update(self.new_entries)
+        print('Saved {} new links to the cache "{}"'.format(len(self.new_entries), self.filename))
+        self.new_entries = {}
@@ -0,0 +1,69 @@
+"""Results of the previous run by the content hash of the source rows, used to re-process only new or changed rows"""
+import os
+import json
+import sqlite3
+
+from hashlib import md5
+
+VERSION = 2  # Part of the digest, manifests of the earlier versions had all of the cells as strings
+
+
+class RowManifest(object):
+    """Previous run results are read from the manifest file and the results of the current run are collected into
+    a new one which replaces it on save(), so rows deleted from the source drop out of the manifest as well."""
+
+    def __init__(self, filename, digest):
+        self.filename = filename
+        self.new_filename = filename + '.new'
+        self.digest = digest = '{}:{}'.format(VERSION, digest)
+        self.reused = 0
+        self.processed = 0
+
+        self.previous = None
+        if os.path.exists(filename):
+            self.previous = sqlite3.connect(filename)
+            previous_digest = self.previous.execute('SELECT digest FROM meta').fetchone()[0]
+            if previous_digest != digest:
+                print('Tasks files, processing code or the manifest format changed since the manifest "{}" was '
+                      'written, processing all of the rows'.format(filename))
+                self.previous.close()
+                self.previous = None
+
+        if os.path.exists(self.new_filename):
+            os.remove(self.new_filename)
+        self.current = sqlite3.connect(self.new_filename)
+        self.current.execute('CREATE TABLE meta (digest TEXT)')
+        self.current.execute('INSERT INTO meta VALUES (?)', (digest,))
+        self.current.execute('CREATE TABLE rows (hash TEXT PRIMARY KEY, is_valid INTEGER, row TEXT)')
+
+    @staticmethod
+    def row_hash(row):
+        return md5('\0'.join(row).encode('utf-8')).hexdigest()
+
+    def __contains__(self, row_hash):
+        if self.previous is None:
+            return False
+        return self.previous.execute('SELECT 1 FROM rows WHERE hash = ?', (row_hash,)).fetchone() is not None
+
+    def reuse(self, row_hash):
+        """Result of the previous run for the row as a (row, is_valid) pair"""
+        is_valid, row = self.previous.execute('SELECT is_valid, row FROM rows WHERE hash = ?', (row_hash,)).fetchone()
+        self.current.execute('INSERT OR IGNORE INTO rows VALUES (?, ?, ?)', (row_hash, is_valid, row))
+        self.reused += 1
+        return json.loads(row), bool(is_valid)
+
+    def add(self, row_hash, row, is_valid):
+        # Cells keep their types, strings, floats, booleans and None, so reused rows produce exactly the same output
+        # in the columnar format as well as in CSV
+        self.current.execute('INSERT OR IGNORE INTO rows VALUES (?, ?, ?)',
+                             (row_hash, is_valid, json.dumps(row, ensure_ascii=False)))
+        self.processed += 1
+
+    def save(self):
+        self.current.commit()
+        self.current.close()
+        if self.previous is not None:
+            self.previous.close()
+        os.replace(self.new_filename, self.filename)
+        print('Reused {} rows and processed {}, manifest was written to: {}'.format(
+            self.reused, self.processed, self.filename))
@@ -0,0 +1,102 @@
+"""Fuzzy matching of manually entered filenames against the filenames from the tasks list"""
+import heapq
+
+import Levenshtein
+
+from collections import defaultdict
+from itertools import chain
+
+
+NGRAM_SIZE = 3
+MAX_EDITS = 2  # Typos in a filename we still expect to find a match for
+MIN_SCORE = 0.8  # Jaro-Winkler similarity below which a task isn't considered a match at all
+TOP_K = 2  # Best match and a runner-up to see how confident the match is
+PREFIX_SIZE = 3  # Length of the beginning of a filename to look for the tasks it starts with
+
+
+def ngrams(s, n=NGRAM_SIZE):
+    """Set of character n-grams of a padded string, so the beginning and the end of the string count as well"""
+    if not s:
+        return set()
+    padded = '^' * (n - 1) + s + '$' * (n - 1)
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class TaskMatcher(object):
+    """N-gram index over normalized task filenames which finds the best scoring tasks without scanning all of them"""
+
+    def __init__(self, tasks, min_score=MIN_SCORE, max_edits=MAX_EDITS):
+        self.min_score = min_score
+        self.max_edits = max_edits
+        self.names = []
+        self.links = []
+        postings = defaultdict(list)
+        for task_fname, link in tasks:
+            task_id = len(self.names)
+            self.names.append(task_fname)
+            self.links.append(link)
+            for gram in ngrams(task_fname):
+                postings[gram].append(task_id)
+        self.postings = dict(postings)
+
+    @classmethod
+    def from_buckets(cls, buckets, **kwargs):
+        """Build a matcher from the prefix buckets produced by fix.parse_tasks()/fix.parse_user_tasks()"""
+        return cls(chain.from_iterable(buckets.values()), **kwargs)
+
+    @classmethod
+    def from_tables(cls, names, links, postings, **kwargs):
+        """Use prebuilt tables as they are, e.g. the ones mapped from a task index
+
+        names and links are sequences indexed by the task id and postings has get(gram, default) returning the task
+        ids of a gram, see taskindex.py.
+        """
+        matcher = cls((), **kwargs)
+        matcher.names = names
+        matcher.links = links
+        matcher.postings = postings
+        return matcher
+
+    def __len__(self):
+        return len(self.names)
+
+    def candidates(self, filename):
+        """Ids of the tasks that may be within max_edits from the filename"""
+        grams = ngrams(filename)
+        if not grams:
+            return set()
+        # Every edit breaks at most NGRAM_SIZE grams so a close enough task has to share this many of them...
+        required = max(1, len(grams) - NGRAM_SIZE * self.max_edits)
+        # ...and thus has to be in at least one of the (len(grams) - required + 1) rarest grams postings.
+        # Ties are broken by the gram itself, otherwise the candidates would depend on the order of the set
+        rarest = sorted(grams, key=lambda gram: (len(self.postings.get(gram, ())), gram))
+        found = set()
+        for gram in rarest[:len(grams) - required + 1]:
+            found.update(self.postings.get(gram, ()))
+        return found
+
+    def prefix_candidates(self, filename):
+        """Ids of the tasks starting with the same PREFIX_SIZE characters as the filename"""
+        prefix = filename[:PREFIX_SIZE]
+        if not prefix:
+            return []
+        # Padding only occurs at the beginning of a name, so the last padded gram of the prefix is only found in the
+        # names starting with it, or with its first NGRAM_SIZE - 1 characters for the longer prefixes
+        padded = '^' * (NGRAM_SIZE - 1) + prefix
+        start = min(len(prefix), NGRAM_SIZE - 1) - 1
+        return [task_id for task_id in self.postings.get(padded[start:start + NGRAM_SIZE], ())
+                if self.names[task_id].startswith(prefix)]
+
+    def score(self, filename, task_ids, k=TOP_K):
+        scored = ((Levenshtein.jaro_winkler(filename, self.names[task_id]), self.links[task_id])
+                  for task_id in task_ids)
+        return heapq.nlargest(k, (match for match in scored if match[0] >= self.min_score))
+
+    def top(self, filename, k=TOP_K):
+        """Up to k (score, link) pairs for the best matching tasks, best first"""
+        matches = self.score(filename, self.candidates(filename), k)
+        if not matches:
+            # Filenames with a few extra characters, e.g. "_копія", are too many edits away from their task while
+            # still scoring high, so the tasks with the same beginning are scored as well
+            matches = self.score(filename, self.prefix_candidates(filename), k)
+        return matches
@@ -0,0 +1,77 @@
+"""Bounded caches of the cleaning rules and normalizers, one per kind of value, with their counters kept"""
+from functools import lru_cache
+from collections import Counter
+
+import instrument
+
+MEMO_SIZE = 1 << 16  # Values cached for every kind
+
+caches = {}  # Cached functions by the kind of value
+counted = {}  # Hits and misses of the caches that are already taken, by the kind
+stats = Counter()  # memo.<kind>.hits/misses of the run, those of the worker processes included
+
+
+def memoize(kind, func, size=MEMO_SIZE):
+    """Cached version of the function for the values of the kind, call it after instrument.enable() if at all"""
+    counted[kind] = (0, 0)
+    if not instrument.enabled():
+        cached = caches[kind] = lru_cache(size)(func)
+        return cached
+
+    cached = caches[kind] = lru_cache(size)(with_counters(func))
+
+    def replay_counters(value):
+        result, added = cached(value)
+        instrument.add_counters(added)
+        return result
+    return replay_counters
+
+
+def with_counters(func):
+    """Function returning the result of func along with the counters it added, which are kept out of the report"""
+    def call(value):
+        before = instrument.take_counters()
+        try:
+            result = func(value)
+        finally:
+            added = instrument.take_counters()
+            instrument.add_counters(before)
+        return result, added
+    return call
+
+
+def clear():
+    """Empty all of the caches, e.g. in a worker process which got a copy of them from its parent"""
+    for kind, cached in caches.items():
+        cached.cache_clear()
+        counted[kind] = (0, 0)
+
+
+def take_stats():
+    """Hits and misses since the last call as memo.<kind>.hits/misses, for worker processes to send them over"""
+    taken = Counter()
+    for kind, cached in caches.items():
+        info = cached.cache_info()
+        hits, misses = counted[kind]
+        taken['memo.{}.hits'.format(kind)] = info.hits - hits
+        taken['memo.{}.misses'.format(kind)] = info.misses - misses
+        counted[kind] = (info.hits, info.misses)
+    return taken
+
+
+def add_stats(taken):
+    """Add the hits and misses to the ones of the run, and to the counters of the run report if it's enabled
+
+    The hit rate of a kind is then hits / (hits + misses) of all of the processes of the run.
+    """
+    stats.update(taken)
+    for name, n in taken.items():
+        instrument.count(name, n)
+
+
+def print_stats():
+    """Print the hits and misses of the run, the ones of this process since the last take_stats() included"""
+    add_stats(take_stats())
+    if caches:
+        print('Memo hits: {}, misses: {}'.format(sum(n for name, n in stats.items() if name.endswith('.hits')),
+                                                 sum(n for name, n in stats.items() if name.endswith('.misses'))))
@@ -1,77 +1,257 @@
 """Merges results of manual processing into a single CSV. Requires 3 CSVs: original, "movables" and positions."""
 import sys
-import csv
+import os
+import argparse
 
-from itertools import groupby
+import fileio
+import instrument
+
+from contextlib import contextmanager
+from itertools import groupby, zip_longest
+from operator import itemgetter
+from extsort import external_sort, estimate_size, MEMORY_BUDGET
+from rowstore import share_string
+from columnar import is_columnar, load as load_columnar
 
 POSITION_COLS = ('Регіон', 'Структура', 'Посада')  # Copy only these columns from the positions doc
 GROUP_NUM_NAME = 'Номер групи'
 
 
-def read_file(filename, encoding='utf-8'):
-    with open(filename, 'r', newline='', encoding=encoding) as source:
+@contextmanager
+def open_file(filename, encoding='utf-8'):
+    """Rows of the file are read lazily while the context is open, yields (rows, fieldnames)"""
+    if is_columnar(filename):
+        fieldnames, data = load_columnar(filename)
+        yield (dict(zip(fieldnames, row)) for row in data), fieldnames
+        return
+
+    with fileio.reading(filename, encoding, dict_rows=True, delimiter=';') as reader:
         print('Reading the file "{}"'.format(filename))
-        reader = csv.DictReader(source, delimiter=';')
-        return [r for r in reader], reader.fieldnames
+        yield reader, reader.fieldnames
+
+
+def fits(filename, memory_budget):
+    """Whether the data of the file fits into the memory budget, judging by its size"""
+    return fileio.data_size(filename, os.path.getsize(filename)) <= memory_budget
 
 
 def write_result(data, fieldnames, filename):
-    with open(filename, 'w', newline='', encoding='utf-8') as dest:
-        # "ignore" is set for extras as default "raise" has O(n^2) on fieldnames lookup and thrashes performance,
-        # so it's important that all dict keys have a corresponding item in fieldnames.
-        writer = csv.DictWriter(dest, fieldnames, delimiter=';', extrasaction='ignore')
+    count = 0
+    # "ignore" is set for extras as default "raise" has O(n^2) on fieldnames lookup and thrashes performance,
+    # so it's important that all dict keys have a corresponding item in fieldnames.
+    with fileio.BackgroundWriter(filename, fieldnames=fieldnames, delimiter=';', extrasaction='ignore') as writer:
         writer.writeheader()
-        writer.writerows(data)
-    print('Result was written to: {}'.format(filename))
+        for row in data:
+            writer.writerow(row)
+            count += 1
+    print('Result was written to: {} ({} rows)'.format(filename, count))
+    return count
+
+
+class JoinReport(object):
+    """Counters of a join to report keys that didn't match or were duplicated"""
+
+    def __init__(self, name):
+        self.name = name
+        self.matched = 0
+        self.unmatched = 0
+        self.duplicate_keys = set()
+        self.unused_keys = set()
+        self.unused_rows = 0  # Rows of the other side left over when the rows are matched by their order
+
+    def print_summary(self):
+        print('Merged {}: {} rows matched, {} rows without a match'.format(self.name, self.matched, self.unmatched))
+        instrument.count('{}.matched'.format(self.name), self.matched)
+        instrument.count('{}.unmatched'.format(self.name), self.unmatched)
+        instrument.count('{}.duplicate_keys'.format(self.name), len(self.duplicate_keys))
+        instrument.count('{}.unused_keys'.format(self.name), len(self.unused_keys))
+        instrument.count('{}.unused_rows'.format(self.name), self.unused_rows)
+        if self.duplicate_keys:
+            print('  {} keys are duplicated in {}, only first rows were used: {}'.format(
+                len(self.duplicate_keys), self.name, ', '.join(sorted(self.duplicate_keys)[:20])))
+        if self.unused_keys:
+            print('  {} keys of {} matched no rows: {}'.format(
+                len(self.unused_keys), self.name, ', '.join(sorted(self.unused_keys)[:20])))
+        if self.unused_rows:
+            print('  {} rows of {} were left over after the last row to match'.format(self.unused_rows, self.name))
+
+
+def movables_columns(fieldnames):
+    # Whatever has "ОБЩ" in it + a special one gets copied over to the merge
+    return [k for k in fieldnames if 'ОБЩ' in k or k == 'Результат сверки машин']
+
+
+def key_value(row, key):
+    """Value of the key column, an empty string for the rows too short to have it, which DictReader fills with None"""
+    value = row.get(key)
+    return '' if value is None else value
+
+
+def build_index(rows, key, columns, report):
+    """Build side of a hash join: only the needed columns of the first row of every key"""
+    index = {}
+    for row in rows:
+        row_key = key_value(row, key)
+        if row_key in index:
+            report.duplicate_keys.add(row_key)
+        else:
+            # Regions and positions repeat a lot, so the same strings are shared between the keys
+            index[row_key] = tuple(share_string(row[col]) for col in columns)
+    report.unused_keys = set(index)
+    return index
+
+
+def hash_join(rows, index, key, columns, report, keep_unmatched):
+    for row in rows:
+        row_key = key_value(row, key)
+        values = index.get(row_key)
+        if values is None:
+            report.unmatched += 1
+            if not keep_unmatched:
+                continue
+        else:
+            row.update(zip(columns, values))
+            report.matched += 1
+            report.unused_keys.discard(row_key)
+        yield row
+
 
+def sort_merge_join(rows, other_rows, key, columns, report, keep_unmatched, memory_budget):
+    """Join of the inputs sorted externally by the key, for the build side that doesn't fit into memory
 
-def merge_movables(original, movables):
-    merged = []
-    fieldnames = set()
+    Rows come out in their input order, the same as hash_join() has them, which takes one more sort on disk.
+    """
+    print('Joining {} by sorting on disk...'.format(report.name))
+    joined = join_sorted(enumerate(rows), other_rows, key, columns, report, keep_unmatched, memory_budget)
+    for _, row in external_sort(joined, key=itemgetter(0), memory_budget=memory_budget,
+                                sizeof=lambda x: estimate_size(x[1])):
+        yield row
 
-    for i, row in enumerate(movables):
+
+def join_sorted(numbered_rows, other_rows, key, columns, report, keep_unmatched, memory_budget):
+    """(position, row) pairs of the joined rows in the order of the key, see sort_merge_join()"""
+    def other_key_of(row):
+        return key_value(row, key)
+
+    def row_key_of(numbered_row):
+        return key_value(numbered_row[1], key)
+
+    others = groupby(external_sort(other_rows, key=other_key_of, memory_budget=memory_budget), key=other_key_of)
+
+    def next_other():
+        """Next key of the other side and the first row of it, the same as build_index() keeps"""
+        other_key, other_group = next(others, (None, None))
+        if other_key is None:
+            return None, None
+        other_row = next(other_group)
+        if next(other_group, None) is not None:
+            report.duplicate_keys.add(other_key)
+        return other_key, other_row
+
+    other_key, other_row = next_other()
+    for row_key, group in groupby(external_sort(numbered_rows, key=row_key_of, memory_budget=memory_budget,
+                                                sizeof=lambda x: estimate_size(x[1])),
+                                  key=row_key_of):
+        while other_key is not None and other_key < row_key:
+            report.unused_keys.add(other_key)
+            other_key, other_row = next_other()
+
+        values = None
+        if other_key == row_key:
+            values = {col: value for col, value in other_row.items() if col in columns}
+            other_key, other_row = next_other()
+
+        for num, row in group:
+            if values is None:
+                report.unmatched += 1
+                if not keep_unmatched:
+                    continue
+            else:
+                row.update(values)
+                report.matched += 1
+            yield num, row
+
+    while other_key is not None:
+        report.unused_keys.add(other_key)
+        other_key, other_row = next_other()
+
+
+def merge_movables(original, movables, columns, key=None, in_memory=True, memory_budget=MEMORY_BUDGET):
+    """Copy the movables columns to the original rows, by the key column or by the position of rows if it's None"""
+    report = JoinReport('movables')
+    if key is None:
         # Movables doc is identical in ordering so don't bother with any special handling
-        merged.append(original[i])
-        for k, v in row.items():
-            # Whatever has "ОБЩ" in it + a special one gets copied over to the merge
-            if 'ОБЩ' in k or k == 'Результат сверки машин':
-                merged[i][k] = v
-                fieldnames.add(k)
-    print('Merged movables')
-
-    return merged, list(fieldnames)
-
-
-def merge_positions(original, positions):
-    # Positions doc has only one record per group so we have to match by groups and duplicate on other items in it
-    orig_by_group = {k: list(v) for k, v in groupby(original, key=lambda x: x[GROUP_NUM_NAME])}
-    merged = []
-    used_groups = set()
-    fieldnames = list(POSITION_COLS)
-
-    for row in positions:
-        group_num = row[GROUP_NUM_NAME]
-        # Some groups are duplicated in the positions doc
-        if group_num not in used_groups:
-            orig_rows = orig_by_group[group_num]
-            for orig_row in orig_rows:
-                for col in POSITION_COLS:
+        for orig_row, row in zip_longest(original, movables):
+            if orig_row is None:
+                report.unused_rows += 1
+                continue
+            if row is None:
+                # Left without the movables columns, the same as the rows that didn't match by the key
+                report.unmatched += 1
+            else:
+                for col in columns:
                     orig_row[col] = row[col]
-            merged.extend(orig_rows)
-            used_groups.add(group_num)
-    print('Merged positions')
+                report.matched += 1
+            yield orig_row
+    elif in_memory:
+        yield from hash_join(original, build_index(movables, key, columns, report), key, columns, report, True)
+    else:
+        yield from sort_merge_join(original, movables, key, columns, report, True, memory_budget)
+    report.print_summary()
+
+
+def merge_positions(original, positions, in_memory=True, memory_budget=MEMORY_BUDGET):
+    """Copy position columns to the original rows by the group number, rows of groups without a position are dropped"""
+    # Positions doc has only one record per group (some are duplicated though) so it's the build side of the join
+    report = JoinReport('positions')
+    if in_memory:
+        yield from hash_join(original, build_index(positions, GROUP_NUM_NAME, POSITION_COLS, report),
+                             GROUP_NUM_NAME, POSITION_COLS, report, False)
+    else:
+        yield from sort_merge_join(original, positions, GROUP_NUM_NAME, POSITION_COLS, report, False, memory_budget)
+    report.print_summary()
+
+
+def merge_files(original_filename, movables_filename, positions_filename, movables_key=None,
+                memory_budget=MEMORY_BUDGET, dest_filename='merged_declarations.csv'):
+    """Merge movables and positions into the original rows and write them to the dest file, returns the rows written
+
+    Files larger than the memory budget are sorted on disk and joined as they are read.
+    """
+    with open_file(original_filename) as (original, original_fieldnames), \
+            open_file(movables_filename, encoding='cp1251') as (movables, movables_fieldnames), \
+            open_file(positions_filename) as (positions, _):
+        movables_fieldnames = movables_columns(movables_fieldnames)
+        merged = merge_movables(original, movables, movables_fieldnames, movables_key,
+                                fits(movables_filename, memory_budget), memory_budget)
+        merged = merge_positions(merged, positions, fits(positions_filename, memory_budget), memory_budget)
+        return write_result(merged, original_fieldnames + movables_fieldnames + list(POSITION_COLS), dest_filename)
+
 
-    return merged, fieldnames
+def add_arguments(parser):
+    parser.add_argument('--movables-key', metavar='COLUMN',
+                        help='Column to join movables on, rows are matched by their order if not set')
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET // (1024 * 1024), metavar='MB',
+                        help='Merge inputs larger than that are joined on disk')
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 4:
-        sys.exit('Usage: {} original-filename movables-filename positions-filename'.format(sys.argv[0]))
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('original_filename')
+    parser.add_argument('movables_filename')
+    parser.add_argument('positions_filename')
+    add_arguments(parser)
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
 
-    original, original_fieldnames = read_file(sys.argv[1])
-    movables, _ = read_file(sys.argv[2], encoding='cp1251')
-    positions, _ = read_file(sys.argv[3])
+    for filename in (args.original_filename, args.movables_filename, args.positions_filename):
+        if not os.path.exists(filename):
+            sys.exit('File "{}" does not exist'.format(filename))
+    if args.profile:
+        instrument.enable(args.profile, args.cprofile)
 
-    merged, movables_fieldnames = merge_movables(original, movables)
-    merged, positions_fieldnames = merge_positions(merged, positions)
-    write_result(merged, original_fieldnames + movables_fieldnames + positions_fieldnames, 'merged_declarations.csv')
+    # Reading, both joins and writing are interleaved row by row, so they are measured as a single stage
+    with instrument.stage('merge') as stage:
+        stage.rows = merge_files(args.original_filename, args.movables_filename, args.positions_filename,
+                                 args.movables_key, args.memory_budget * 1024 * 1024)
+    instrument.save('merge.py')
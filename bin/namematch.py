@@ -0,0 +1,133 @@
+"""Fuzzy matching of the normalized full names, for the names with typos, swapped parts or spelled in Latin
+
+Names are split into transliterated tokens and put into blocks by a few keys: the sorted tokens, a phonetic key
+that ignores vowels and the ways to transliterate a letter, and prefixes of every token along with the initials of
+the rest of them. Only names sharing a block are compared, big blocks are only compared within a window of the
+names sorted alphabetically, so the number of comparisons grows linearly with the number of names.
+
+A pair of names matches when their tokens can be paired so that every pair differs by a typo at most, initials
+only match the same initials. The score of a match is the mean Jaro-Winkler similarity of the pairs.
+"""
+import Levenshtein
+
+from itertools import combinations, permutations
+
+MIN_SCORE = 0.9  # Mean similarity of the tokens below which names aren't considered the same
+PREFIX_SIZE = 3
+MAX_BLOCK_SIZE = 50  # Blocks of up to this many names are compared pairwise...
+WINDOW = 10  # ...and each name of a bigger block is compared to this many names following it
+LONG_TOKEN = 10  # Tokens of this length and longer may have two typos
+MAX_TOKENS = 4  # Names are normalized to 3 parts, more of them are a mistake not worth the permutations
+
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'h', 'ґ': 'g', 'д': 'd', 'е': 'e', 'є': 'ie', 'ж': 'zh', 'з': 'z', 'и': 'y',
+    'і': 'i', 'ї': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's',
+    'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ь': '', 'ю': 'iu',
+    'я': 'ia', 'ъ': '', 'ы': 'y', 'э': 'e', 'ё': 'e', '’': '', "'": '', '`': '',
+})
+# Letters and their combinations sounding the same or transliterated differently, applied in this order
+PHONETIC_REPLACEMENTS = (('shch', 's'), ('sch', 's'), ('kh', 'h'), ('zh', 'z'), ('ts', 'c'), ('ch', 'c'),
+                         ('sh', 's'), ('ph', 'f'), ('g', 'h'), ('w', 'v'), ('q', 'k'), ('x', 'ks'))
+VOWELS = frozenset('aeiouyj')
+
+
+def name_tokens(name):
+    """Lowercase Latin parts of the name"""
+    name = name.lower().translate(TRANSLIT)
+    return tuple(''.join(c if c.isalpha() else ' ' for c in name).split())
+
+
+def phonetic(token):
+    """Consonants of the token the way they sound, without repeats"""
+    for letters, replacement in PHONETIC_REPLACEMENTS:
+        token = token.replace(letters, replacement)
+    key = []
+    for c in token:
+        if c not in VOWELS and (not key or key[-1] != c):
+            key.append(c)
+    return ''.join(key)
+
+
+def blocking_keys(tokens):
+    """Keys of the blocks a name goes to, a matching name is expected to share at least one of them"""
+    keys = {'s:' + ' '.join(sorted(tokens)),
+            'p:' + ' '.join(sorted(phonetic(token) for token in tokens))}
+    for num, token in enumerate(tokens):
+        if len(token) > PREFIX_SIZE:
+            initials = sorted(other[0] for other_num, other in enumerate(tokens) if other_num != num)
+            keys.add('x:{}|{}'.format(token[:PREFIX_SIZE], ''.join(initials)))
+    return keys
+
+
+def is_typo(a, b):
+    """Whether the tokens differ by a typo: an edit, two of them for long tokens, or swapped adjacent letters"""
+    limit = 1 if min(len(a), len(b)) < LONG_TOKEN else 2
+    if abs(len(a) - len(b)) > limit:
+        return False
+    if Levenshtein.distance(a, b) <= limit:
+        return True
+    if len(a) != len(b):
+        return False
+    diffs = [i for i, (x, y) in enumerate(zip(a, b)) if x != y]
+    return len(diffs) == 2 and diffs[1] == diffs[0] + 1 and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]
+
+
+def token_similarity(a, b):
+    if a == b:
+        return 1.0
+    if len(a) == 1 or len(b) == 1 or not is_typo(a, b):
+        return 0.0
+    return Levenshtein.jaro_winkler(a, b)
+
+
+def name_similarity(a, b):
+    """Best score of pairing the tokens of the names, 0 if they can't be paired"""
+    if len(a) != len(b) or not a or len(a) > MAX_TOKENS:
+        return 0.0
+    similarity = []
+    for x in a:
+        row = [token_similarity(x, y) for y in b]
+        if not any(row):
+            # Most of the compared names differ in the very first token, no point in pairing the rest of them
+            return 0.0
+        similarity.append(row)
+    best = 0.0
+    for order in permutations(range(len(b))):
+        scores = [row[col] for row, col in zip(similarity, order)]
+        if all(scores):
+            best = max(best, sum(scores) / len(scores))
+    return best
+
+
+def block_pairs(block, sort_keys):
+    """Pairs of the names of a block to compare"""
+    if len(block) <= MAX_BLOCK_SIZE:
+        return combinations(block, 2)
+    block = sorted(block, key=sort_keys.__getitem__)
+    return ((a, b) for i, a in enumerate(block) for b in block[i + 1:i + 1 + WINDOW])
+
+
+def match_names(names, min_score=MIN_SCORE, connected=None):
+    """Pairs (i, j, score) of the names considered to be the same, the names are expected to be distinct
+
+    connected(i, j) may tell which names are known to be in the same group already, they aren't compared then,
+    passing the matches found so far is enough to not compare the same names again.
+    """
+    tokens = [name_tokens(name) for name in names]
+    sort_keys = [' '.join(sorted(name)) for name in tokens]
+    blocks = {}
+    for num, name in enumerate(tokens):
+        # Initials alone are too common to tell anything
+        if any(len(token) > 1 for token in name):
+            for key in blocking_keys(name):
+                blocks.setdefault(key, []).append(num)
+
+    for block in blocks.values():
+        for a, b in block_pairs(block, sort_keys):
+            # Pairs that share several blocks are compared again unless they matched, remembering all of the pairs
+            # would take more memory than the names themselves
+            if connected is not None and connected(a, b):
+                continue
+            score = 1.0 if sort_keys[a] == sort_keys[b] else name_similarity(tokens[a], tokens[b])
+            if score >= min_score:
+                yield a, b, score
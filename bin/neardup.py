@@ -0,0 +1,59 @@
+"""Near-duplicate detection with MinHash signatures and LSH banding, so that only rows sharing a band get compared"""
+import struct
+
+from hashlib import blake2b
+from unionfind import UnionFind
+
+NUM_BANDS = 8
+BAND_SIZE = 4  # Rows sharing all of the values in any band are compared, ~0.6 similarity has 50% chance to get there
+MAX_BUCKET_SIZE = 16  # Rows of a bucket every next row in it is compared to
+
+# A single 64 bytes blake2b digest per feature provides all of the 32 16-bit hash functions for the signature
+unpack_hashes = struct.Struct('<{}H'.format(NUM_BANDS * BAND_SIZE)).unpack
+
+
+def row_features(row, columns):
+    """Set of the non-empty (column, value) pairs of the row"""
+    return {'{}:{}'.format(col, row[col]) for col in columns if col < len(row) and row[col] != ''}
+
+
+def minhash(features):
+    hashes = [unpack_hashes(blake2b(feature.encode('utf-8')).digest()) for feature in features]
+    return [min(values) for values in zip(*hashes)]
+
+
+def similarity(a, b):
+    return len(a & b) / len(a | b)
+
+
+def find_near_duplicates(rows, columns, threshold):
+    """Clusters of indices of the rows whose features over the columns are at least threshold similar
+
+    Each row is compared to the rows that got into the same LSH buckets before it, unless they are in its cluster
+    already, so any two rows sharing a bucket are compared whatever the order of the rows. Only the first
+    MAX_BUCKET_SIZE rows of a bucket are kept for that, a pair of rows beyond them in a bucket that large is only
+    found through another bucket or transitively. Clusters are ordered by their first rows and include single rows.
+    """
+    clusters = UnionFind(len(rows))
+    buckets = {}
+    bucketed = {}  # Features of the rows that are in the buckets, by the index of the row
+    for num, row in enumerate(rows):
+        features = row_features(row, columns)
+        if not features:
+            continue
+        signature = minhash(features)
+        compared = set()
+        for band in range(NUM_BANDS):
+            key = (band, tuple(signature[band * BAND_SIZE:(band + 1) * BAND_SIZE]))
+            members = buckets.setdefault(key, [])
+            for other in members:
+                if other in compared or clusters.find(other) == clusters.find(num):
+                    continue
+                compared.add(other)
+                if similarity(features, bucketed[other]) >= threshold:
+                    clusters.union(other, num)
+            if len(members) < MAX_BUCKET_SIZE:
+                members.append(num)
+                bucketed[num] = features
+
+    return clusters.groups()
@@ -0,0 +1,274 @@
+"""Runs fix, group, format and merge in a single process, passing the rows between the stages in memory
+
+The same functions the scripts are made of are wired into stages, each of them takes named values of the run state
+and adds its own ones:
+
+    fix                    source file -> header, rows, invalid
+    deduplicate            rows -> rows
+    merge_near_duplicates  rows -> rows
+    save                   header, rows, invalid -> processed_<timestamp>.csv, invalid_<timestamp>.csv
+    project                header, rows -> processed_header, processed
+    group                  processed_header, processed -> grouped_<timestamp>.xlsx
+    format                 processed_header, processed -> formatted_<timestamp>.xlsx
+    merge                  original, movables and positions files -> merged_declarations.csv
+
+Stages always run in this order and the ones producing what the requested stages need are added to the run. With a
+checkpoint directory the state is pickled after every stage, so a run with --resume continues after the last stage
+that has finished, unless the input files, the scripts or the options the results depend on have changed since.
+"""
+import sys
+import os
+import glob
+import pickle
+import argparse
+
+import fix
+import format
+import group
+import merge
+import instrument
+
+from datetime import datetime
+from linkcache import files_digest
+from rowstore import ColumnStore
+
+CHECKPOINT_FILENAME = 'pipeline.pickle'
+DEFAULT_STAGES = ('fix', 'group', 'format')
+# Options the results depend on, a checkpoint made with any of them set differently isn't resumed. The rest of them,
+# e.g. --workers or --link-cache, only change how fast the same results are made.
+OUTPUT_OPTIONS = ('incremental', 'seen_index', 'near_duplicate_threshold', 'num_sheets', 'group_sheets', 'exact_names',
+                  'shards', 'original', 'movables', 'positions', 'movables_key')
+
+
+class Stage(object):
+    def __init__(self, name, run, requires=(), provides=()):
+        self.name = name
+        self.run = run  # Takes the state and the arguments, returns a dict of the provided values
+        self.requires = requires
+        self.provides = provides
+
+
+def as_text(value):
+    """Value the way it reads from a CSV written by csv.writer, so results don't depend on how the rows got here"""
+    return '' if value is None else str(value)
+
+
+def collect_rows(header, results):
+    """Keep the results of fix.process_source() in memory for the next stages"""
+    rows = ColumnStore()
+    invalid = []
+    for row, is_valid in results:
+        if is_valid:
+            rows.append(row)
+        else:
+            invalid.append(row)
+    rows.freeze()
+    return {'header': header, 'rows': rows, 'invalid': invalid}
+
+
+def run_fix(state, args):
+    return fix.process_source(args.source_filename, args.tasks_filename, args.user_tasks_filename, args.workers,
+                              args.link_cache, args.incremental, task_index_filename=args.task_index,
+                              seen_index_filename=args.seen_index, dest=collect_rows)
+
+
+def run_deduplicate(state, args):
+    return {'rows': fix.deduplicate(state['rows'])}
+
+
+def run_merge_near_duplicates(state, args):
+    return {'rows': fix.merge_near_duplicates(state['rows'], args.near_duplicate_threshold)}
+
+
+def run_save(state, args):
+    timestamp = datetime.now()
+    fix.write_dest('processed_{:%Y-%m-%d_%H:%M:%S}.csv'.format(timestamp), state['rows'], state['header'])
+    fix.write_dest('invalid_{:%Y-%m-%d_%H:%M:%S}.csv'.format(timestamp), state['invalid'], state['header'])
+    return {}
+
+
+def run_project(state, args):
+    """Rows in the layout of the processed file, which is what group and format work with"""
+    processed = ColumnStore()
+    processed.extend([as_text(value) for value in fix.processed_row(row)] for row in state['rows'])
+    processed.freeze()
+    return {'processed_header': fix.processed_row(state['header']), 'processed': processed}
+
+
+def run_group(state, args):
+    grouped_data = group.group_by_link_and_name(state['processed'], not args.exact_names)
+    write_groups(group.output_header(state['processed_header'], state['processed']), grouped_data, args.group_sheets,
+                 [group.COL_NAME_NORMALIZED], args, 'grouped')
+    return {}
+
+
+def run_format(state, args):
+    grouped_data = format.group_by_link(state['processed'])
+    write_groups(state['processed_header'], list(grouped_data.values()), args.num_sheets, format.HIGHLIGHT_COLS,
+                 args, 'formatted')
+    return {}
+
+
+def write_groups(header, grouped_data, num_sheets, highlight_cols, args, prefix):
+    if args.shards:
+        format.write_sharded_result(header, grouped_data, num_sheets, highlight_cols, args.workers, prefix)
+    else:
+        format.write_result(header, grouped_data, num_sheets, highlight_cols, prefix)
+
+
+def run_merge(state, args):
+    merge.merge_files(args.original, args.movables, args.positions, args.movables_key,
+                      args.memory_budget * 1024 * 1024)
+    return {}
+
+
+STAGES = (
+    Stage('fix', run_fix, provides=('header', 'rows', 'invalid')),
+    Stage('deduplicate', run_deduplicate, requires=('rows',), provides=('rows',)),
+    Stage('merge_near_duplicates', run_merge_near_duplicates, requires=('rows',), provides=('rows',)),
+    Stage('save', run_save, requires=('header', 'rows', 'invalid')),
+    Stage('project', run_project, requires=('header', 'rows'), provides=('processed_header', 'processed')),
+    Stage('group', run_group, requires=('processed_header', 'processed')),
+    Stage('format', run_format, requires=('processed_header', 'processed')),
+    Stage('merge', run_merge),
+)
+
+
+def plan_stages(names):
+    """Stages to run for the requested ones in the order of STAGES, along with the stages providing their inputs"""
+    unknown = set(names) - {stage.name for stage in STAGES}
+    if unknown:
+        raise ValueError('Unknown stages: {}'.format(', '.join(sorted(unknown))))
+
+    planned = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for num, stage in enumerate(STAGES):
+            if stage.name not in planned:
+                continue
+            earlier = STAGES[:num]
+            for key in stage.requires:
+                if not any(key in other.provides for other in earlier if other.name in planned):
+                    # The first stage that provides the value is enough, the rest of them only refine it
+                    planned.add(next(other.name for other in earlier if key in other.provides))
+                    changed = True
+    return [stage for stage in STAGES if stage.name in planned]
+
+
+def run_settings(stages, args):
+    """Stages of the run and the values of the OUTPUT_OPTIONS"""
+    settings = {name: getattr(args, name) for name in OUTPUT_OPTIONS}
+    settings['stages'] = [stage.name for stage in stages]
+    return settings
+
+
+def run_digest(stages, args):
+    """Hash of the input files and of the scripts, all of the modules next to this one as the stages import them"""
+    filenames = [args.source_filename, args.tasks_filename, args.user_tasks_filename]
+    if any(stage.name == 'merge' for stage in stages):
+        filenames += [args.original, args.movables, args.positions]
+    return files_digest(*filenames, *sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   '*.py'))))
+
+
+def load_checkpoint(directory, digest, settings):
+    """Names of the finished stages and the state after them, nothing if the checkpoint is missing or outdated"""
+    filename = os.path.join(directory, CHECKPOINT_FILENAME)
+    if not os.path.exists(filename):
+        return [], {}
+    with open(filename, 'rb') as source:
+        checkpoint = pickle.load(source)
+    if checkpoint['digest'] != digest:
+        print('Inputs or scripts have changed since the checkpoint "{}", starting over'.format(filename))
+        return [], {}
+    previous = checkpoint.get('settings', {})
+    changed = sorted(name for name in settings if previous.get(name) != settings[name])
+    if changed:
+        print('Checkpoint "{}" was made with different {}, starting over'.format(filename, ', '.join(changed)))
+        return [], {}
+    print('Resuming after the stages: {}'.format(', '.join(checkpoint['finished'])))
+    return checkpoint['finished'], checkpoint['state']
+
+
+def save_checkpoint(directory, digest, settings, finished, state):
+    filename = os.path.join(directory, CHECKPOINT_FILENAME)
+    # Written next to the previous one and swapped, a run that fails midway keeps the last good checkpoint
+    with open(filename + '.new', 'wb') as dest:
+        pickle.dump({'digest': digest, 'settings': settings, 'finished': finished, 'state': state}, dest,
+                    pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + '.new', filename)
+
+
+def run(stages, args, checkpoint_dir=None, resume=False):
+    finished, state = [], {}
+    if checkpoint_dir:
+        digest = run_digest(stages, args)
+        settings = run_settings(stages, args)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        if resume:
+            finished, state = load_checkpoint(checkpoint_dir, digest, settings)
+
+    for stage in stages:
+        if stage.name in finished:
+            continue
+        print('Running the stage "{}"'.format(stage.name))
+        with instrument.stage(stage.name):
+            state.update(stage.run(state, args))
+        finished.append(stage.name)
+        if checkpoint_dir:
+            save_checkpoint(checkpoint_dir, digest, settings, finished, state)
+    return state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the processing from the raw results to the XLSX for review')
+    parser.add_argument('source_filename')
+    parser.add_argument('tasks_filename')
+    parser.add_argument('user_tasks_filename')
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES),
+                        help='Comma separated stages to run, see the docstring of the module for the list')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes to process the rows and to write the shards with')
+    fix.add_arguments(parser)
+    parser.add_argument('--near-duplicate-threshold', type=float, default=fix.NEAR_DUPLICATE_THRESHOLD,
+                        metavar='SHARE', help='Similarity of the rows the merge_near_duplicates stage merges')
+    parser.add_argument('--num-sheets', type=int, default=format.NUM_SHEETS,
+                        help='Number of sheets of the workbook written by format')
+    parser.add_argument('--group-sheets', type=int, default=1, help='Number of sheets of the workbook written by group')
+    group.add_arguments(parser)
+    format.add_arguments(parser)
+    parser.add_argument('--original', help='Original file of the merge stage')
+    parser.add_argument('--movables', help='Movables file of the merge stage')
+    parser.add_argument('--positions', help='Positions file of the merge stage')
+    merge.add_arguments(parser)
+    parser.add_argument('--checkpoint-dir', metavar='DIR', help='Save the state of the run after every stage here')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the stages that have finished according to the checkpoint')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        stages = plan_stages(args.stages.split(','))
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.resume and not args.checkpoint_dir:
+        sys.exit('--resume needs a --checkpoint-dir')
+
+    filenames = [args.source_filename, args.tasks_filename, args.user_tasks_filename]
+    if any(stage.name == 'merge' for stage in stages):
+        if not (args.original and args.movables and args.positions):
+            sys.exit('The merge stage needs --original, --movables and --positions')
+        filenames += [args.original, args.movables, args.positions]
+    for filename in filenames:
+        if not os.path.exists(filename):
+            sys.exit('File "{}" does not exist'.format(filename))
+
+    if args.profile:
+        instrument.enable(args.profile, args.cprofile)
+        fix.count_clean_rules()
+    if args.memo_size:
+        fix.memoize_rules(args.memo_size)
+
+    run(stages, args, args.checkpoint_dir, args.resume)
+    instrument.save('pipeline.py')
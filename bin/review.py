@@ -0,0 +1,270 @@
+"""Local web page to review the groups a page at a time, instead of rendering all of them into a workbook"""
+import sys
+import os
+import html
+import json
+import math
+import mmap
+import time
+import argparse
+import tempfile
+
+import xlsxwriter
+import format
+import group
+import namematch
+
+from array import array
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from columnar import BlockWriter, TRAILER, block
+from rowstore import width
+from taskindex import source_stamps, read_header
+
+MAGIC = b'ODGRPS01'
+PAGE_SIZE = 20  # Groups on a page
+STYLE = '''
+body { font-family: sans-serif; font-size: 13px; }
+table { border-collapse: collapse; }
+th, td { border: 1px solid #DDDDDD; padding: 2px 4px; white-space: nowrap; }
+th { position: sticky; top: 0; background: #EEEEEE; }
+tr.first td { border-top: 2px solid black; }
+td.mismatch { background: #FF8080; }
+'''
+
+
+def group_rows(data, by, fuzzy=True):
+    """Row numbers of every group in the order of the workbooks, and the name match confidence of the rows by name"""
+    if by == 'link':
+        return [[row.num for row in rows] for rows in format.group_by_link(data).values()], None
+
+    groups = []
+    confidence = array('d')  # Of the rows in the order of the groups, NaN stands for no name match
+    for rows in group.group_by_link_and_name(data, fuzzy):
+        groups.append([scored.row.num for scored in rows])
+        confidence.extend(math.nan if scored.confidence == '' else scored.confidence for scored in rows)
+    return groups, confidence
+
+
+def dump_index(filename, groups, confidence, settings, sources):
+    """Write the groups made with the settings out of the sources"""
+    with open(filename + '.new', 'wb') as dest:
+        blocks = BlockWriter(dest, MAGIC)
+        nums = array('I')
+        bounds = array('Q', [0])
+        for rows in groups:
+            nums.extend(rows)
+            bounds.append(len(nums))
+        meta = {
+            'settings': settings,
+            'sources': source_stamps(sources),
+            'groups': len(groups),
+            'nums': [blocks.write(nums.tobytes()), len(nums)],
+            'bounds': blocks.write(bounds.tobytes()),
+        }
+        if confidence is not None:
+            meta['confidence'] = blocks.write(confidence.tobytes())
+        header = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        header_offset = blocks.write(header)
+        dest.write(TRAILER.pack(header_offset, len(header)))
+    os.replace(filename + '.new', filename)
+    print('Group index was written to: {}'.format(filename))
+
+
+class GroupIndex(object):
+    """Row numbers of the groups and the confidence of the rows, right from the mapped index"""
+
+    def __init__(self, nums, bounds, confidence=None):
+        self.nums = nums
+        self.bounds = bounds
+        self.confidence = confidence
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def rows(self, num):
+        """Row numbers of the group along with their confidence, None for the groups by link"""
+        lower_bound, upper_bound = self.bounds[num], self.bounds[num + 1]
+        confidence = None
+        if self.confidence is not None:
+            confidence = ['' if math.isnan(value) else value for value in self.confidence[lower_bound:upper_bound]]
+        return self.nums[lower_bound:upper_bound], confidence
+
+
+def load_index(filename, settings, sources):
+    """Map the index if it was made with the settings out of the sources as they are now, None otherwise"""
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as source:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if view[:len(MAGIC)] != MAGIC:
+        return None
+    meta = read_header(view)
+    if meta['settings'] != settings or meta['sources'] != source_stamps(sources):
+        return None
+
+    nums_offset, num_rows = meta['nums']
+    confidence = None
+    if 'confidence' in meta:
+        confidence = block(view, meta['confidence'], 'd', num_rows)
+    return GroupIndex(block(view, nums_offset, 'I', num_rows), block(view, meta['bounds'], 'Q', meta['groups'] + 1),
+                      confidence)
+
+
+class Review(object):
+    """Groups of the rows the way the workbook of format.py or group.py would have them"""
+
+    def __init__(self, header, data, index, by):
+        self.data = data
+        self.index = index
+        if by == 'link':
+            self.header = header
+            self.highlight_cols = format.HIGHLIGHT_COLS
+        else:
+            self.header = group.output_header(header, data)
+            self.highlight_cols = [group.COL_NAME_NORMALIZED]
+            self.data_width = width(data)
+
+    def __len__(self):
+        return len(self.index)
+
+    def group(self, num):
+        nums, confidence = self.index.rows(num)
+        if confidence is None:
+            return [self.data[row_num] for row_num in nums]
+        return [group.ScoredRow(self.data[row_num], self.data_width, row_confidence)
+                for row_num, row_confidence in zip(nums, confidence)]
+
+    def page(self, page, page_size):
+        """(group number, rows, mismatched columns) of the groups of the page"""
+        groups = []
+        for num in range(page * page_size, min((page + 1) * page_size, len(self))):
+            rows = [list(row) for row in self.group(num)]
+            groups.append((num, rows, format.mismatched_cols(rows, self.highlight_cols) if rows else frozenset()))
+        return groups
+
+    def workbook(self, num):
+        """XLSX file of a single group as bytes"""
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'group.xlsx')
+            workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+            format.write_sheet(workbook.add_worksheet('Book1'), format.FormatCache(workbook),
+                               ["Номер групи"] + self.header, [self.group(num)], self.highlight_cols, num)
+            workbook.close()
+            with open(filename, 'rb') as source:
+                return source.read()
+
+
+def render_page(review, page, page_size):
+    num_pages = max(1, math.ceil(len(review) / page_size))
+    links = []
+    if page > 0:
+        links.append('<a href="/?page={}">&larr; previous</a>'.format(page - 1))
+    links.append('page {} of {}, {} groups'.format(page + 1, num_pages, len(review)))
+    if page + 1 < num_pages:
+        links.append('<a href="/?page={}">next &rarr;</a>'.format(page + 1))
+    navigation = '<p>{}</p>'.format(' | '.join(links))
+
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>Review, page {}</title><style>{}</style>'
+             '</head><body>'.format(page + 1, STYLE), navigation, '<table><tr><th>Номер групи</th><th></th>']
+    parts.extend('<th>{}</th>'.format(html.escape(str(title))) for title in review.header)
+    parts.append('</tr>')
+    for num, rows, mismatches in review.page(page, page_size):
+        for row_num, row in enumerate(rows):
+            parts.append('<tr class="first">' if row_num == 0 else '<tr>')
+            parts.append('<td>{}</td><td>{}</td>'.format(
+                num, '<a href="/groups/{}.xlsx">xlsx</a>'.format(num) if row_num == 0 else ''))
+            parts.extend('<td class="mismatch">{}</td>'.format(html.escape(str(cell))) if col in mismatches
+                         else '<td>{}</td>'.format(html.escape(str(cell))) for col, cell in enumerate(row))
+            parts.append('</tr>')
+    parts.extend(['</table>', navigation, '</body></html>'])
+    return ''.join(parts)
+
+
+def page_json(review, page, page_size):
+    return json.dumps({
+        'page': page,
+        'pages': max(1, math.ceil(len(review) / page_size)),
+        'header': review.header,
+        'groups': [{'num': num, 'rows': rows, 'mismatched_cols': sorted(mismatches)}
+                   for num, rows, mismatches in review.page(page, page_size)],
+    }, ensure_ascii=False)
+
+
+class ReviewHandler(BaseHTTPRequestHandler):
+    """Serves the Review and the page size set on the server"""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        review = self.server.review
+        try:
+            page = max(0, int(parse_qs(url.query).get('page', ['0'])[0]))
+        except ValueError:
+            return self.send_error(400, 'Page should be a number')
+
+        if url.path == '/':
+            self.send_body(render_page(review, page, self.server.page_size).encode('utf-8'),
+                           'text/html; charset=utf-8')
+        elif url.path == '/groups':
+            self.send_body(page_json(review, page, self.server.page_size).encode('utf-8'),
+                           'application/json; charset=utf-8')
+        elif url.path.startswith('/groups/') and url.path.endswith('.xlsx'):
+            num = url.path[len('/groups/'):-len('.xlsx')]
+            if not num.isdigit() or int(num) >= len(review):
+                return self.send_error(404, 'No such group')
+            self.send_body(review.workbook(int(num)),
+                           'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                           'attachment; filename="group_{}.xlsx"'.format(num))
+        else:
+            self.send_error(404)
+
+    def send_body(self, body, content_type, disposition=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if disposition:
+            self.send_header('Content-Disposition', disposition)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the groups of the processed file for review')
+    parser.add_argument('source_filename')
+    parser.add_argument('--by', choices=('link', 'name'), default='link',
+                        help='Group by links the way format.py does or by names and links the way group.py does')
+    group.add_arguments(parser)
+    parser.add_argument('--index', metavar='FILENAME',
+                        help='Where to keep the groups, next to the source file by default')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='Number of groups on a page')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source_filename):
+        sys.exit('File "{}" does not exist'.format(args.source_filename))
+
+    started = time.perf_counter()
+    header, data = format.load_source(args.source_filename, lazy_values=True)
+    index_filename = args.index or '{}.{}.groups'.format(args.source_filename, args.by)
+    settings = {'by': args.by, 'fuzzy': args.by == 'name' and not args.exact_names}
+    # Groups change along with the code making them as well
+    sources = (args.source_filename, format.__file__, group.__file__, namematch.__file__)
+    index = load_index(index_filename, settings, sources)
+    if index is None:
+        print('Group index "{}" is missing or outdated, grouping the rows'.format(index_filename))
+        groups, confidence = group_rows(data, args.by, settings['fuzzy'])
+        dump_index(index_filename, groups, confidence, settings, sources)
+        index = load_index(index_filename, settings, sources)
+
+    server = ThreadingHTTPServer((args.host, args.port), ReviewHandler)
+    server.review = Review(header, data, index, args.by)
+    server.page_size = args.page_size
+    print('Serving {} groups at http://{}:{}/, ready in {:.2f}s'.format(
+        len(server.review), args.host, args.port, time.perf_counter() - started))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
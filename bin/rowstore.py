@@ -0,0 +1,149 @@
+"""Compact column-oriented storage of the rows shared by the scripts
+
+Each column is dictionary encoded: distinct values are kept once per column and rows only hold 2 or 4 bytes codes
+of them, so repeated values ("приховано", regions, amounts) cost next to nothing. Rows are accessed through
+lightweight Row views and whole columns can be scanned without touching the rest of the data.
+"""
+from array import array
+
+SHARED_MAX_LENGTH = 128  # Longer values are unlikely to repeat and are not shared by share_string()
+
+shared_strings = {}
+
+
+def share_string(value):
+    """Share the same string object between equal short values, unlike sys.intern() they are kept for good
+
+    Anything but a string, e.g. None of a short csv.DictReader row, is returned as it is.
+    """
+    if not isinstance(value, str) or len(value) > SHARED_MAX_LENGTH:
+        return value
+    return shared_strings.setdefault(value, value)
+
+
+class Row(object):
+    """A row of the ColumnStore, indexed either by the column number or by the column name"""
+    __slots__ = ('store', 'num')
+
+    def __init__(self, store, num):
+        self.store = store
+        self.num = num
+
+    def __len__(self):
+        return self.store.lengths[self.num]
+
+    def __getitem__(self, col):
+        length = self.store.lengths[self.num]
+        if isinstance(col, slice):
+            return [self[i] for i in range(*col.indices(length))]
+        if isinstance(col, str):
+            col = self.store.index[col]
+        elif col < 0:
+            col += length
+        if not 0 <= col < length:
+            raise IndexError('row index out of range')
+        return self.store.values[col][self.store.codes[col][self.num]]
+
+    def __iter__(self):
+        num = self.num
+        store = self.store
+        for col in range(store.lengths[num]):
+            yield store.values[col][store.codes[col][num]]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return 'Row({!r})'.format(list(self))
+
+
+class ColumnStore(object):
+    """Sequence of rows with an optional header, see the module docstring"""
+
+    def __init__(self, header=None):
+        self.header = header
+        self.index = {name: col for col, name in enumerate(header or ())}
+        self.lengths = array('H')
+        self.codes = []
+        self.values = []  # Distinct values of every column, the code 0 is always an empty string
+        self.lookups = []  # Code by value for every column, only needed while rows are appended
+
+    def add_column(self):
+        self.codes.append(array('H', [0]) * len(self.lengths))
+        self.values.append([''])
+        self.lookups.append({'': 0})
+
+    def append(self, row):
+        while len(self.codes) < len(row):
+            self.add_column()
+
+        for col, value in enumerate(row):
+            lookup = self.lookups[col]
+            code = lookup.get(value)
+            if code is None:
+                values = self.values[col]
+                code = lookup[value] = len(values)
+                values.append(value)
+                if code == 1 << 16:
+                    # Too many distinct values for 2 bytes codes
+                    self.codes[col] = array('I', self.codes[col])
+            self.codes[col].append(code)
+        for col in range(len(row), len(self.codes)):
+            self.codes[col].append(0)
+        self.lengths.append(len(row))
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def freeze(self):
+        """Drop the structures only needed to append the rows"""
+        self.lookups = None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, num):
+        if isinstance(num, slice):
+            return [Row(self, i) for i in range(*num.indices(len(self)))]
+        if num < 0:
+            num += len(self)
+        if not 0 <= num < len(self):
+            raise IndexError('store index out of range')
+        return Row(self, num)
+
+    def __iter__(self):
+        for num in range(len(self)):
+            yield Row(self, num)
+
+    def column(self, col):
+        """All of the values of a column, empty for the rows that are too short to have it"""
+        if isinstance(col, str):
+            col = self.index[col]
+        if col >= len(self.codes):
+            return [''] * len(self)
+        values = self.values[col]
+        return [values[code] for code in self.codes[col]]
+
+
+def column(rows, col):
+    """Values of the column for any sequence of rows, without materializing them for a ColumnStore"""
+    if isinstance(rows, ColumnStore):
+        return rows.column(col)
+    return [row[col] for row in rows]
+
+
+def argsort(keys):
+    """Positions of the keys in their stable sorted order
+
+    Only the keys are sorted, so the rows they were taken from can be picked by their positions afterwards without
+    keeping a sorted copy of them. Rows streamed from a file go through extsort.sort_by_column() instead.
+    """
+    return sorted(range(len(keys)), key=keys.__getitem__)
+
+
+def width(rows):
+    """Number of columns of the longest row"""
+    if isinstance(rows, ColumnStore):
+        return max(rows.lengths, default=0)
+    return max((len(row) for row in rows), default=0)
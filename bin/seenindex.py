@@ -0,0 +1,50 @@
+"""On-disk set of the row hashes written by the earlier runs, for dropping duplicates across the runs
+
+Only the hashes are kept, 16 bytes each, and looked up one at a time, so neither the index nor the old outputs are
+read into memory. Hashes of the current run are collected in memory and only written on save(), so a run that fails
+midway doesn't mark its rows as seen.
+"""
+import sqlite3
+
+HASH_SCHEME = 'blake2b-128'  # How fix.row_hash() hashes rows, hashes made any other way don't match the current ones
+
+
+class SeenIndex(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.new_hashes = set()
+        self.seen_before = 0  # Rows dropped as written by an earlier run...
+        self.repeated = 0  # ...and as repeating an earlier row of this run
+
+        self.conn = sqlite3.connect(filename)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (scheme TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS hashes (hash BLOB PRIMARY KEY) WITHOUT ROWID')
+            scheme = self.conn.execute('SELECT scheme FROM meta').fetchone()
+            if scheme is None:
+                self.conn.execute('INSERT INTO meta VALUES (?)', (HASH_SCHEME,))
+            elif scheme[0] != HASH_SCHEME:
+                print('Rows were hashed differently when the index "{}" was written, starting it over'.format(filename))
+                self.conn.execute('DELETE FROM hashes')
+                self.conn.execute('UPDATE meta SET scheme = ?', (HASH_SCHEME,))
+        self.size = self.conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+        print('Seen index "{}" has {} hashes'.format(filename, self.size))
+
+    def add(self, row_hash):
+        """Remember the hex hash of a row, returns False if it has been seen already"""
+        key = bytes.fromhex(row_hash)
+        if key in self.new_hashes:
+            self.repeated += 1
+            return False
+        if self.size and self.conn.execute('SELECT 1 FROM hashes WHERE hash = ?', (key,)).fetchone() is not None:
+            self.seen_before += 1
+            return False
+        self.new_hashes.add(key)
+        return True
+
+    def save(self):
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO hashes VALUES (?)', ((key,) for key in self.new_hashes))
+        self.conn.close()
+        print('Dropped {} rows seen in the earlier runs and {} repeated ones, saved {} new hashes to "{}"'.format(
+            self.seen_before, self.repeated, len(self.new_hashes), self.filename))
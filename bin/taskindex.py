@@ -0,0 +1,193 @@
+"""Compiled index of the task lists, memory-mapped by fix.py instead of parsing the lists on every start"""
+import os
+import sys
+import json
+import mmap
+
+from array import array
+from collections import Counter
+from columnar import BlockWriter, StringTable, TRAILER, block
+from matcher import TaskMatcher, NGRAM_SIZE
+
+MAGIC = b'ODTASK01'
+
+
+def source_stamps(filenames):
+    """What tells that a file has changed without reading it: the path, the size and the modification time"""
+    stamps = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stamps.append([os.path.abspath(filename), stat.st_size, stat.st_mtime_ns])
+    return stamps
+
+
+class MappedPostings(object):
+    """Task ids by n-gram with the same get() as the postings dict of a TaskMatcher"""
+
+    def __init__(self, grams, bounds, ids):
+        self.index = {gram: num for num, gram in enumerate(grams)}
+        self.grams = grams
+        self.bounds = bounds
+        self.ids = ids
+
+    def get(self, gram, default=None):
+        num = self.index.get(gram)
+        if num is None:
+            return default
+        return self.ids[self.bounds[num]:self.bounds[num + 1]]
+
+    def __reduce__(self):
+        return MappedPostings, (self.grams, array('Q', self.bounds), array('I', self.ids))
+
+
+class UserMatchers(object):
+    """TaskMatcher of every user by email, the same way fix.build_matchers() returns them"""
+
+    def __init__(self, emails, bounds, names, links):
+        self.index = {email: num for num, email in enumerate(emails)}
+        self.emails = emails
+        self.bounds = bounds
+        self.names = names
+        self.links = links
+        self.matchers = {}
+
+    def __contains__(self, email):
+        return email in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, email):
+        matcher = self.matchers.get(email)
+        if matcher is None:
+            num = self.index[email]
+            matcher = self.matchers[email] = TaskMatcher(
+                (self.names[task_id], self.links[task_id])
+                for task_id in range(self.bounds[num], self.bounds[num + 1]))
+        return matcher
+
+    def items(self):
+        return ((email, self[email]) for email in self.index)
+
+    def __reduce__(self):
+        return UserMatchers, (self.emails, array('Q', self.bounds), self.names, self.links)
+
+
+def dump(filename, tasks, ambiguous_tasks, user_tasks, sources):
+    """Write the matchers and the ambiguity counts, sources are the files they were built from"""
+    with open(filename + '.new', 'wb') as dest:
+        blocks = BlockWriter(dest, MAGIC)
+
+        grams = sorted(tasks.postings)
+        bounds = array('Q', [0])
+        ids = array('I')
+        for gram in grams:
+            ids.extend(tasks.postings[gram])
+            bounds.append(len(ids))
+
+        emails = sorted(user_tasks)
+        user_bounds = array('Q', [0])
+        user_names = []
+        user_links = []
+        for email in emails:
+            user_names.extend(user_tasks[email].names)
+            user_links.extend(user_tasks[email].links)
+            user_bounds.append(len(user_names))
+
+        ambiguous = sorted(name for name, count in ambiguous_tasks.items() if count > 1)
+
+        header = json.dumps({
+            'ngram_size': NGRAM_SIZE,
+            'sources': source_stamps(sources),
+            'tasks': {
+                'size': len(tasks),
+                'names': blocks.write_strings(tasks.names),
+                'links': blocks.write_strings(tasks.links),
+                'grams': [len(grams)] + blocks.write_strings(grams),
+                'bounds': blocks.write(bounds.tobytes()),
+                'ids': [blocks.write(ids.tobytes()), len(ids)],
+            },
+            'users': {
+                'emails': [len(emails)] + blocks.write_strings(emails),
+                'bounds': blocks.write(user_bounds.tobytes()),
+                'names': [len(user_names)] + blocks.write_strings(user_names),
+                'links': blocks.write_strings(user_links),
+            },
+            'ambiguous': {
+                'names': [len(ambiguous)] + blocks.write_strings(ambiguous),
+                'counts': blocks.write(array('I', (ambiguous_tasks[name] for name in ambiguous)).tobytes()),
+            },
+        }, ensure_ascii=False).encode('utf-8')
+        header_offset = blocks.write(header)
+        dest.write(TRAILER.pack(header_offset, len(header)))
+    # A worker or another run may have the old index mapped, it keeps it until it's done
+    os.replace(filename + '.new', filename)
+    print('Task index was written to: {}'.format(filename))
+
+
+def read_header(view):
+    header_offset, header_length = TRAILER.unpack(view[-TRAILER.size:])
+    return json.loads(bytes(view[header_offset:header_offset + header_length]).decode('utf-8'))
+
+
+def is_fresh(filename, sources):
+    """Whether the index exists and was built from the sources as they are now"""
+    if not os.path.exists(filename):
+        return False
+    with open(filename, 'rb') as source:
+        if source.read(len(MAGIC)) != MAGIC:
+            return False
+        source.seek(-TRAILER.size, os.SEEK_END)
+        header_offset, header_length = TRAILER.unpack(source.read(TRAILER.size))
+        source.seek(header_offset)
+        header = json.loads(source.read(header_length).decode('utf-8'))
+    return header['ngram_size'] == NGRAM_SIZE and header['sources'] == source_stamps(sources)
+
+
+def load(filename):
+    """Map the index, returns (tasks, ambiguous_tasks, user_tasks) the way fix.load_tasks() does"""
+    with open(filename, 'rb') as source:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if view[:len(MAGIC)] != MAGIC:
+        raise ValueError('"{}" is not a task index'.format(filename))
+    meta = read_header(view)
+
+    def strings(count, blob_offset, blob_length, offsets_offset):
+        text = bytes(view[blob_offset:blob_offset + blob_length]).decode('utf-8')
+        return StringTable(text, block(view, offsets_offset, 'Q', count + 1))
+
+    meta_tasks = meta['tasks']
+    num_grams = meta_tasks['grams'][0]
+    tasks = TaskMatcher.from_tables(
+        strings(meta_tasks['size'], *meta_tasks['names']),
+        strings(meta_tasks['size'], *meta_tasks['links']),
+        MappedPostings(strings(*meta_tasks['grams']), block(view, meta_tasks['bounds'], 'Q', num_grams + 1),
+                       block(view, meta_tasks['ids'][0], 'I', meta_tasks['ids'][1])))
+
+    meta_users = meta['users']
+    num_users = meta_users['emails'][0]
+    num_user_tasks = meta_users['names'][0]
+    user_tasks = UserMatchers(strings(*meta_users['emails']), block(view, meta_users['bounds'], 'Q', num_users + 1),
+                              strings(*meta_users['names']), strings(num_user_tasks, *meta_users['links']))
+
+    meta_ambiguous = meta['ambiguous']
+    names = strings(*meta_ambiguous['names'])
+    ambiguous_tasks = Counter(dict(zip(names, block(view, meta_ambiguous['counts'], 'I', len(names)))))
+
+    print('Mapped {} tasks of {} users from "{}"'.format(len(tasks), len(user_tasks), filename))
+    return tasks, ambiguous_tasks, user_tasks
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        sys.exit('Usage: {} tasks-file user-tasks-file index-file'.format(sys.argv[0]))
+    for filename in sys.argv[1:3]:
+        if not os.path.exists(filename):
+            sys.exit('File "{}" does not exist'.format(filename))
+
+    import fix  # Imported here as fix.py imports this module itself
+    fix.compile_tasks(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -0,0 +1,44 @@
+"""Disjoint sets to merge groups of rows transitively"""
+
+
+class UnionFind(object):
+    """Disjoint sets over the numbers 0..size-1"""
+
+    def __init__(self, size=0):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self):
+        """Add a new single element set, returns its element"""
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            # Path halving keeps the trees flat without recursion
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def groups(self):
+        """Lists of the elements of every set, ordered by their smallest elements"""
+        groups = {}
+        for x in range(len(self.parent)):
+            groups.setdefault(self.find(x), []).append(x)
+        return list(groups.values())
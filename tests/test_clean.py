@@ -0,0 +1,144 @@
+"""fix.clean() compared with the plain cell-by-cell version of the cleaning rules it was compiled from, and the rule
+counters of the run report"""
+import os
+import re
+import csv
+import sys
+
+from collections import Counter
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import fix  # noqa: E402
+import instrument  # noqa: E402
+
+WIDTH = 318  # Columns of the raw export
+TEXT_COL = 20
+BOOLEAN_COL = fix.BOOLEAN_COLS[0]
+YEAR_COL = fix.YEAR_COLS[1]
+CAPITALIZED_COL = fix.CAPITALIZE_COLS[0]
+
+VALUES = (
+    # Empty and "nothing here" markers
+    '', ' ', '\n', '0', '00', 'Прочерк', 'прочерк', '-', '—', '--', ' - — ', '-0-',
+    # Numbers
+    '12', '007', '0.00', '5.5', '5.555', '1.5.2', '١٢', '²', '12 345', '12 345,67', '12,5', '1,234,56',
+    '12.345.678,90', '1, 2', '100 грн', '100 грн.', '100 гр', '1 000,5 грн', '-15,5',
+    # Hidden values
+    'приховано', 'Приховано', 'ПРИХОВАНО', '(приховано)', '"Приховано"', '[ПРИХОВАНО]', '-приховано-',
+    'дані (приховано) тут', 'приховано 12,5',
+    # Years
+    '2015', '15', "'15", '15 р.', '2015 рік', '2015-2016 роки, дуже довго',
+    # Text
+    'abc', 'a, b', 'іван', 'text "quoted" x', "м'ята", 'м`ята', 'м*ята', 'в i село', 'в 1 село', 'i', ' 1 ',
+    'line\nbreak', 'tab\there', '\xa0nbsp\xa0', '  spaces  around  ', 'true', 'false',
+)
+
+
+def clean_reference(row):
+    """Straightforward cell-by-cell version of the cleaning rules, fix.clean() must produce the very same output"""
+    cleaned_row = []
+    for num, col in enumerate(row):
+        col = col.replace('\n', ';')
+        col = re.sub(r'\s', ' ', col)
+        col = col.strip()
+        # Yeah, "Прочерк" it is...
+        if col in ('0', 'Прочерк', 'прочерк'):
+            col = ''
+        if not any(filter(lambda x: x not in ('-', '—'), col)):
+            col = ''
+        if num in fix.BOOLEAN_COLS:
+            col = 'true' if len(col) > 0 else 'false'
+        elif col != '':
+            if num in fix.CAPITALIZE_COLS:
+                col = col[0].upper() + col[1:]
+            # People put this in whatever way they want
+            col = re.sub(r'["(-\[]приховано[")-\]]', 'приховано', col, flags=re.I)
+            if col == 'Приховано':
+                col = 'приховано'
+
+            if num in fix.YEAR_COLS and len(col) <= 10:
+                # Fix year values
+                col = ''.join(filter(lambda x: x.isdigit(), col))
+                if len(col) == 2:
+                    col = '20{}'.format(col)
+            else:
+                # Fix decimals
+                col = re.sub(r'грн?\.?$', '', col).rstrip()
+                if not any(filter(lambda x: not x.isdigit() and x not in (',', '.', ' '), col)) and ', ' not in col:
+                    # Remove spaces if it looks like a decimal without any other chars
+                    col = col.replace(' ', '')
+                col = re.sub(r'(\d+),(\d+)', r'\g<1>.\g<2>', col)
+                # Coerce money-looking decimals to a common format
+                col = re.sub(r'\d+\.\d{1,2}', lambda x: str(Decimal(x.group(0)).quantize(Decimal('.01'))), col)
+                if all(map(lambda x: x.isdigit(), col)):
+                    col = '{}.00'.format(col)
+
+            # Fix apostrophes
+            col = re.sub(r'([^a-zA-Z\d_])["\'`*]([^a-zA-Z\d_])', r'\g<1>’\g<2>', col)
+            # Fix Ukrainian "і"
+            col = re.sub(r'([^a-zA-Z\d_])[1i]([^a-zA-Z\d_])', r'\g<1>і\g<2>', col)
+        cleaned_row.append(col)
+
+    return cleaned_row
+
+
+def row_with(col, value):
+    row = [''] * WIDTH
+    row[col] = value
+    return row
+
+
+@pytest.mark.parametrize('col', (TEXT_COL, BOOLEAN_COL, YEAR_COL, CAPITALIZED_COL))
+@pytest.mark.parametrize('value', VALUES)
+def test_clean_matches_reference(col, value):
+    row = row_with(col, value)
+    assert fix.clean(row)[col] == clean_reference(row)[col]
+
+
+def test_clean_whole_row():
+    row = [VALUES[num % len(VALUES)] for num in range(WIDTH)]
+    assert fix.clean(row) == clean_reference(row)
+
+
+def test_clean_short_and_long_rows():
+    for width in (0, 1, BOOLEAN_COL + 1, WIDTH + 10):
+        row = [VALUES[num % len(VALUES)] for num in range(width)]
+        assert fix.clean(row) == clean_reference(row)
+
+
+def test_clean_generated_rows(tmp_path):
+    # After bin/, bench/ has modules named the same as the ones of the scripts
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+    from generate import generate
+
+    generate(str(tmp_path), 500)
+    with open(os.path.join(str(tmp_path), 'source.csv'), newline='', encoding='utf-8') as source:
+        reader = csv.reader(source)
+        next(reader)
+        for row in reader:
+            assert fix.clean(row) == clean_reference(row)
+
+
+@pytest.mark.parametrize('rule, value, expected', [
+    (fix.clean_text, '0', {'clean.strip': 1}),
+    (fix.clean_text, '12', {'clean.money': 1}),
+    (fix.clean_text, '007', {'clean.money': 1}),
+    (fix.clean_text, ' 12', {'clean.strip': 1, 'clean.money': 1}),
+    (fix.clean_year, '15', {'clean.year': 1}),
+    (fix.clean_year, '2015', {}),
+    (fix.clean_year, '0', {'clean.strip': 1}),
+    (fix.clean_year, '12345678901', {'clean.year': 1, 'clean.money': 1}),
+])
+def test_rule_counters_of_digits(monkeypatch, tmp_path, rule, value, expected):
+    monkeypatch.setattr(instrument, 'report_filename', str(tmp_path / 'report.json'))
+    monkeypatch.setattr(instrument, 'counters', Counter())
+    # Counted rules are put back after the test
+    for name in ('_strip_cell', '_fix_hidden', '_fix_money', '_fix_year', '_fix_apostrophes', '_fix_ukrainian_i'):
+        monkeypatch.setattr(fix, name, getattr(fix, name))
+    fix.count_clean_rules()
+    rule(value)
+    assert instrument.counters == Counter(expected)
@@ -0,0 +1,126 @@
+"""Sorting of extsort.external_sort() with the runs spilled to disk, and of the rows deduplicated and grouped with it"""
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import fix  # noqa: E402
+import format  # noqa: E402
+import extsort  # noqa: E402
+from extsort import external_sort  # noqa: E402
+from rowstore import ColumnStore  # noqa: E402
+
+
+def make_items(num_items, seed=0):
+    """(key, position) pairs with many equal keys, the positions show whether the sort was stable"""
+    rnd = random.Random(seed)
+    return [(rnd.randrange(50), num) for num in range(num_items)]
+
+
+def first(item):
+    return item[0]
+
+
+@pytest.mark.parametrize('num_items', [0, 1, 3, 4, 5, 16, 17, 63, 64, 65, 300, 1000])
+def test_more_runs_than_fan_in(monkeypatch, num_items):
+    monkeypatch.setattr(extsort, 'MAX_FAN_IN', 4)
+    items = make_items(num_items)
+    # Every item is a run of its own with no budget at all
+    assert list(external_sort(items, key=first, memory_budget=0)) == sorted(items, key=first)
+
+
+def test_budget_of_several_items(monkeypatch):
+    monkeypatch.setattr(extsort, 'MAX_FAN_IN', 3)
+    items = make_items(2000, seed=1)
+    assert list(external_sort(items, key=first, memory_budget=1000)) == sorted(items, key=first)
+
+
+def test_fits_into_budget():
+    items = make_items(100)
+    assert list(external_sort(items, key=first)) == sorted(items, key=first)
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='Open files are counted in /proc')
+def test_open_files_are_bounded(monkeypatch):
+    monkeypatch.setattr(extsort, 'MAX_FAN_IN', 8)
+    open_files = []
+
+    def sizeof(item):
+        open_files.append(len(os.listdir('/proc/self/fd')))
+        return 1
+
+    items = make_items(3000, seed=2)
+    started_with = len(os.listdir('/proc/self/fd'))
+    assert list(external_sort(items, key=first, memory_budget=0, sizeof=sizeof)) == sorted(items, key=first)
+    # Up to MAX_FAN_IN - 1 runs on each of the levels, 3000 runs take 4 levels of 8
+    assert max(open_files) - started_with < 4 * 8
+
+
+def make_rows(num_rows, col, seed=0):
+    """Rows of strings with many equal values in the column, the first value tells the rows apart"""
+    rnd = random.Random(seed)
+    rows = []
+    for num in range(num_rows):
+        row = [str(num)] + ['v{}'.format(rnd.randrange(3)) for _ in range(col + 1)]
+        row[col] = 'key-{}'.format(rnd.randrange(num_rows // 3 + 1))
+        rows.append(row)
+    return rows
+
+
+def count_spills(monkeypatch):
+    spilled = []
+    spill = extsort.spill
+    monkeypatch.setattr(extsort, 'spill', lambda items: spilled.append(1) or spill(items))
+    return spilled
+
+
+@pytest.mark.parametrize('num_rows', [0, 1, 2, 50, 500])
+def test_deduplicate_spilled(monkeypatch, num_rows):
+    monkeypatch.setattr(extsort, 'MAX_FAN_IN', 4)
+    rows = make_rows(num_rows, fix.COL_HASH)
+    store = ColumnStore()
+    store.extend(rows)
+    in_memory = [list(row) for row in fix.deduplicate(store)]
+    # With no budget at all every row is a run of its own
+    assert [list(row) for row in fix.deduplicate(iter(rows), memory_budget=0)] == in_memory
+    assert [list(row) for row in fix.deduplicate(iter(rows))] == in_memory
+    assert len(in_memory) == len({row[fix.COL_HASH] for row in rows})
+
+
+@pytest.mark.parametrize('num_rows', [0, 1, 2, 50, 500])
+def test_group_by_link_spilled(monkeypatch, num_rows):
+    monkeypatch.setattr(extsort, 'MAX_FAN_IN', 4)
+    rows = make_rows(num_rows, format.COL_LINK, seed=1)
+
+    def as_lists(grouped_data):
+        return [(key, [list(row) for row in group]) for key, group in grouped_data.items()]
+
+    in_memory = as_lists(format.group_by_link(rows))
+    assert as_lists(format.group_by_link(iter(rows), memory_budget=0)) == in_memory
+    assert as_lists(format.group_by_link(iter(rows), memory_budget=10000)) == in_memory
+    assert all(len(group) > 1 for _, group in in_memory)
+
+
+def test_spills_beyond_budget(monkeypatch):
+    spilled = count_spills(monkeypatch)
+    rows = make_rows(200, fix.COL_HASH, seed=2)
+    fix.deduplicate(iter(rows))
+    assert not spilled
+    fix.deduplicate(iter(rows), memory_budget=extsort.estimate_size(rows[0]) * 50)
+    assert len(spilled) >= 3
+
+
+def test_loaded_rows_are_not_spilled(monkeypatch):
+    spilled = count_spills(monkeypatch)
+    rows = make_rows(2000, fix.COL_HASH, seed=3)
+    store = ColumnStore()
+    store.extend(rows)
+    store.freeze()
+    # Over any budget, but the rows are loaded already
+    format.group_by_link(store, memory_budget=0)
+    fix.deduplicate(store, memory_budget=0)
+    fix.deduplicate(rows, memory_budget=0)
+    assert not spilled
@@ -0,0 +1,38 @@
+"""Workbooks and the manifest of format.write_sharded_result()"""
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import format  # noqa: E402
+
+HEADER = ['Timestamp', 'Filename', '1.1 Поле', '1.2 Поле']
+
+
+def make_groups(num_groups):
+    return [[['2015', 'file{}'.format(num), 'a', str(row_num)] for row_num in range(2)] for num in range(num_groups)]
+
+
+@pytest.mark.parametrize('num_groups, num_sheets', [(7, 3), (3, 3), (2, 5), (0, 2)])
+def test_manifest(tmp_path, monkeypatch, num_groups, num_sheets):
+    monkeypatch.chdir(tmp_path)
+    manifest_filename = format.write_sharded_result(HEADER, make_groups(num_groups), num_sheets, [2, 3], workers=1)
+    with open(manifest_filename, encoding='utf-8') as source:
+        manifest = json.load(source)
+
+    assert len(manifest) == num_sheets
+    covered = []
+    for shard in manifest:
+        assert os.path.exists(shard['filename'])
+        if shard['first_group'] is None:
+            assert shard['last_group'] is None
+            # Only the header
+            assert shard['rows'] == 1
+        else:
+            assert shard['first_group'] <= shard['last_group']
+            covered.extend(range(shard['first_group'], shard['last_group'] + 1))
+            assert shard['rows'] == 1 + 2 * (shard['last_group'] - shard['first_group'] + 1)
+    assert covered == list(range(num_groups))
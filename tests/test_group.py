@@ -0,0 +1,81 @@
+"""Groups of group.group_by_link_and_name(), by the same or similar names and by the links, and their ScoredRow"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import group  # noqa: E402
+from group import ScoredRow, group_by_link_and_name  # noqa: E402
+
+
+def make_row(filename, name='', link=''):
+    row = [''] * (group.COL_NAME_NORMALIZED + 1)
+    row[group.COL_FILENAME] = filename
+    row[group.COL_LINK] = link
+    row[group.COL_NAME_NORMALIZED] = name
+    return row
+
+
+def grouped(data, fuzzy=True):
+    """Filenames and confidences of every group, the orphans are the last group"""
+    return [[(row[group.COL_FILENAME], row.confidence) for row in rows] for rows in group_by_link_and_name(data, fuzzy)]
+
+
+def test_name_and_link_groups_are_merged_transitively():
+    data = [
+        make_row('a', 'іваненко іван петрович', '/l/1'),
+        make_row('b', 'петренко олена', '/l/2'),
+        make_row('c', 'іваненко іван петрович', '/l/2'),
+        make_row('d', 'коваленко тарас', '/l/3'),
+        make_row('e', 'шевченко марія', '/l/2'),
+        make_row('f', 'бойко андрій'),
+    ]
+    assert grouped(data) == [
+        # a and c by the name, b and e by the link of c
+        [('a', 1.0), ('b', ''), ('c', 1.0), ('e', '')],
+        [('d', '')],
+        [('f', '')],
+    ]
+
+
+def test_similar_names_are_merged_with_their_links():
+    data = [
+        make_row('a', 'іваненко іван петрович', '/l/1'),
+        make_row('b', 'іваненко іван петровіч', '/l/2'),
+        make_row('c', 'петренко олена', '/l/2'),
+        make_row('d', 'петренко олена', '/l/3'),
+    ]
+    groups = grouped(data)
+    assert [[filename for filename, _ in rows] for rows in groups] == [['a', 'b', 'c', 'd'], []]
+    confidence = dict(groups[0])
+    # Both of the similar names get their score, the rows with the same names linked to them are certain
+    assert confidence['a'] == confidence['b'] < 1.0
+    assert confidence['c'] == confidence['d'] == 1.0
+
+
+def test_exact_names_only():
+    data = [
+        make_row('a', 'іваненко іван петрович', '/l/1'),
+        make_row('b', 'іваненко іван петровіч', '/l/2'),
+        make_row('c', 'іваненко іван петрович'),
+    ]
+    assert grouped(data, fuzzy=False) == [[('a', 1.0), ('c', 1.0)], [('b', '')], []]
+    assert [len(rows) for rows in grouped(data)] == [3, 0]
+
+
+def test_rows_of_other_widths_are_padded():
+    data = [make_row('a', 'іваненко', '/l/1'), make_row('b', 'іваненко', '/l/1') + ['extra']]
+    rows, orphans = group_by_link_and_name(data)
+    assert orphans == []
+    assert [len(row) for row in rows] == [len(data[1]) + 1] * 2
+    assert list(rows[0]) == data[0] + ['', 1.0]
+    assert list(rows[1]) == data[1] + [1.0]
+
+
+@pytest.mark.parametrize('row, width', [(['x', 'y'], 4), (['x', 'y', 'z', 'w'], 4)])
+def test_scored_row(row, width):
+    scored = ScoredRow(row, width, 0.95)
+    assert len(scored) == width + 1
+    assert [scored[col] for col in range(width + 1)] == list(scored) == row + [''] * (width - len(row)) + [0.95]
@@ -0,0 +1,141 @@
+"""Results of fix.py runs reusing the manifest of the previous run compared with the results of full runs"""
+import os
+import re
+import sys
+
+import multiprocessing
+
+import pytest
+
+from collections import Counter
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+# After bin/, bench/ has modules named the same as the ones of the scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+
+import fix  # noqa: E402
+import memo  # noqa: E402
+import fileio  # noqa: E402
+import instrument  # noqa: E402
+import columnar  # noqa: E402
+from generate import generate  # noqa: E402
+
+NUM_ROWS = 300
+COL_LINK_SCORE = 314  # Column of the link score in the processed layout
+
+
+def run_fix(data_dir, source_filename, output_format, manifest_filename=None, workers=1):
+    """Process the source with fix.process_source(), returns the contents of the processed and invalid files"""
+    filenames = [os.path.join(data_dir, '{}.{}'.format(name, output_format)) for name in ('processed', 'invalid')]
+    fix.process_source(source_filename, os.path.join(data_dir, 'tasks.txt'),
+                       os.path.join(data_dir, 'user_tasks.jsonl'), workers, manifest_filename=manifest_filename,
+                       dest=partial(fix.write_results, processed_filename=filenames[0],
+                                    invalid_filename=filenames[1]))
+
+    contents = []
+    for filename in filenames:
+        with open(filename, 'rb') as source:
+            contents.append(source.read())
+        os.remove(filename)
+    return contents
+
+
+def test_columnar_output_reused(tmp_path):
+    data_dir = str(tmp_path)
+    generate(data_dir, NUM_ROWS)
+    source_filename = os.path.join(data_dir, 'source.csv')
+    manifest_filename = os.path.join(data_dir, 'manifest.sqlite')
+
+    full = run_fix(data_dir, source_filename, 'col')
+    assert run_fix(data_dir, source_filename, 'col', manifest_filename) == full
+    # All of the rows come from the manifest this time
+    assert run_fix(data_dir, source_filename, 'col', manifest_filename) == full
+
+    with open(os.path.join(data_dir, 'reused.col'), 'wb') as dest:
+        dest.write(full[0])
+    _, data = columnar.load(os.path.join(data_dir, 'reused.col'))
+    assert any(isinstance(row[COL_LINK_SCORE], float) for row in data)
+
+
+def edit_source(source_filename, edited_filename):
+    """Copy of the source with some of the rows deleted, some changed and some new ones added"""
+    with fileio.reading(source_filename) as reader:
+        header = next(reader)
+        rows = list(reader)
+    edited = []
+    for num, row in enumerate(rows):
+        if num % 7 == 3:
+            continue  # Deleted
+        if num % 5 == 1:
+            row = list(row)
+            row[20] = 'змінено {}'.format(num)
+        edited.append(row)
+        if num % 11 == 0:
+            new_row = list(row)
+            new_row[fix.COL_NAME] = new_row[fix.COL_NAME] + ' Новий'
+            edited.append(new_row)
+    with fileio.BackgroundWriter(edited_filename) as writer:
+        writer.writerow(header)
+        writer.writerows(edited)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_same_as_full_run(tmp_path, monkeypatch, capsys, workers):
+    # Several chunks for the workers
+    monkeypatch.setattr(fix, 'CHUNK_SIZE', 40)
+    data_dir = str(tmp_path)
+    generate(data_dir, NUM_ROWS)
+    source_filename = os.path.join(data_dir, 'source.csv')
+    edited_filename = os.path.join(data_dir, 'edited.csv')
+    edit_source(source_filename, edited_filename)
+    manifest_filename = os.path.join(data_dir, 'manifest.sqlite')
+
+    assert run_fix(data_dir, source_filename, 'csv', manifest_filename, workers) == \
+        run_fix(data_dir, source_filename, 'csv', workers=workers)
+    capsys.readouterr()
+    incremental = run_fix(data_dir, edited_filename, 'csv', manifest_filename, workers)
+    # Only the added and changed rows are processed, the rest of them are reused
+    reused, processed = map(int, re.search(r'Reused (\d+) rows and processed (\d+)', capsys.readouterr().out).groups())
+    assert reused > NUM_ROWS // 2 and 0 < processed < NUM_ROWS // 2
+    full = run_fix(data_dir, edited_filename, 'csv', workers=workers)
+    assert incremental == full
+    assert full[0].count(b'\n') > NUM_ROWS // 2
+    # Deleted rows dropped out of the manifest, so the original source is processed anew where they were
+    assert run_fix(data_dir, source_filename, 'csv', manifest_filename, workers) == \
+        run_fix(data_dir, source_filename, 'csv', workers=workers)
+
+
+def test_rule_counters_of_spawned_workers(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(fix, 'CHUNK_SIZE', 40)
+    # Rules, caches and counters are all put back after the test
+    for name in ('_strip_cell', '_fix_hidden', '_fix_money', '_fix_year', '_fix_apostrophes', '_fix_ukrainian_i',
+                 'clean_boolean', 'clean_year', 'clean_text', 'clean_capitalized', 'normalize_name', 'normalize_fname',
+                 'title', 'capwords', 'rules_counted', 'rules_memo_size'):
+        monkeypatch.setattr(fix, name, getattr(fix, name))
+    for name, value in (('caches', {}), ('counted', {}), ('stats', Counter())):
+        monkeypatch.setattr(memo, name, value)
+    monkeypatch.setattr(instrument, 'report_filename', str(tmp_path / 'report.json'))
+    monkeypatch.setattr(instrument, 'counters', Counter())
+    fix.count_clean_rules()
+    fix.memoize_rules()
+    data_dir = str(tmp_path)
+    generate(data_dir, NUM_ROWS)
+    source_filename = os.path.join(data_dir, 'source.csv')
+
+    def counters():
+        taken = instrument.take_counters()
+        memo.stats.clear()
+        # Workers have caches of their own, so only the number of lookups is the same as in a single process
+        return ({name: n for name, n in taken.items() if name.startswith('clean.')},
+                sum(n for name, n in taken.items() if name.startswith('memo.')))
+
+    serial = run_fix(data_dir, source_filename, 'csv')
+    expected = counters()
+    assert expected[0] and expected[1]
+    # Spawned workers import the module anew rather than getting a copy of the rules set up by the parent
+    monkeypatch.setattr(multiprocessing, 'Pool', multiprocessing.get_context('spawn').Pool)
+    capsys.readouterr()
+    assert run_fix(data_dir, source_filename, 'csv', workers=2) == serial
+    assert counters() == expected
+    assert re.search(r'Memo hits: \d+, misses: \d+', capsys.readouterr().out)
@@ -0,0 +1,35 @@
+"""Resolutions kept by linkcache.LinkCache in a worker process and passed back to the parent"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from linkcache import LinkCache  # noqa: E402
+
+RESOLUTION = ('/d/1/ivanenko_ivan_1234.pdf', 0.95, 0.1, True)
+
+
+def test_taken_entries_are_still_hits(tmp_path):
+    cache = LinkCache(str(tmp_path / 'links.sqlite'), 'digest')
+    key = ('user@example.com', 'ivanenko_ivan_1234')
+    assert cache.get(key) is None
+    cache.put(key, RESOLUTION)
+    new_entries, hits, misses = cache.take_updates()
+    assert (new_entries, hits, misses) == ({key: RESOLUTION}, 0, 1)
+
+    # The next chunk of the same worker
+    assert cache.get(key) == RESOLUTION
+    assert cache.take_updates() == ({}, 1, 0)
+
+
+def test_updates_are_saved_by_the_parent(tmp_path):
+    filename = str(tmp_path / 'links.sqlite')
+    parent = LinkCache(filename, 'digest')
+    worker = LinkCache(filename, 'digest')
+    key = ('', 'petrenko_olena_5678')
+    worker.get(key)
+    worker.put(key, RESOLUTION)
+    parent.add_updates(worker.take_updates())
+    parent.save()
+    assert LinkCache(filename, 'digest').get(key) == RESOLUTION
+    assert LinkCache(filename, 'other digest').get(key) is None
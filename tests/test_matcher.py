@@ -0,0 +1,80 @@
+"""Links matcher.TaskMatcher finds for the filenames, suffixed ones included"""
+import os
+import sys
+
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import fix  # noqa: E402
+import taskindex  # noqa: E402
+from matcher import TaskMatcher  # noqa: E402
+
+TASKS = (
+    '/d/1/ivanenko_ivan_1234.pdf',
+    '/d/2/ivanov_petro_77.pdf',
+    '/d/3/petrenko_olena_5678.pdf',
+    '/d/4/sydorenko_taras_9.pdf',
+)
+
+
+def make_matcher():
+    return TaskMatcher((fix.normalize_fname(task), task) for task in TASKS)
+
+
+def mapped_matcher(tmp_path):
+    tasks_filename = str(tmp_path / 'tasks.txt')
+    user_tasks_filename = str(tmp_path / 'user_tasks.json')
+    index_filename = str(tmp_path / 'tasks.idx')
+    with open(tasks_filename, 'w', encoding='utf-8') as dest:
+        dest.write('\n'.join(TASKS) + '\n')
+    with open(user_tasks_filename, 'w', encoding='utf-8') as dest:
+        dest.write('')
+    fix.compile_tasks(tasks_filename, user_tasks_filename, index_filename)
+    return taskindex.load(index_filename)[0]
+
+
+@pytest.mark.parametrize('filename, link', [
+    ('ivanenko_ivan_1234.pdf', '/d/1/ivanenko_ivan_1234.pdf'),
+    ('ivanenko_ivn_1234', '/d/1/ivanenko_ivan_1234.pdf'),
+    ('petrenko_olena_5678', '/d/3/petrenko_olena_5678.pdf'),
+    # Too many extra characters to be within the edits of the n-gram filter
+    ('ivanenko_ivan_1234 копія.pdf', '/d/1/ivanenko_ivan_1234.pdf'),
+    ('ivanenko_ivan_1234_dekl', '/d/1/ivanenko_ivan_1234.pdf'),
+    ('sydorenko_taras_9 (2).pdf', '/d/4/sydorenko_taras_9.pdf'),
+])
+def test_top_link(filename, link):
+    matches = make_matcher().top(fix.normalize_fname(filename))
+    assert matches and matches[0][1] == link
+
+
+def test_suffixed_filenames_from_task_index(tmp_path):
+    tasks = mapped_matcher(tmp_path)
+    for filename in ('ivanenko_ivan_1234 копія.pdf', 'ivanenko_ivan_1234_dekl'):
+        assert tasks.top(fix.normalize_fname(filename))[0][1] == '/d/1/ivanenko_ivan_1234.pdf'
+
+
+@pytest.mark.parametrize('filename', ['', 'x', 'zzz_unknown_file', 'ivx'])
+def test_no_match(filename):
+    assert make_matcher().top(filename) == []
+
+
+def test_prefix_candidates():
+    matcher = make_matcher()
+    names = {matcher.names[task_id] for task_id in matcher.prefix_candidates('ivanenko_ivan_1234_копія')}
+    assert names == {'ivanenko_ivan_1234', 'ivanov_petro_77'}
+    names = {matcher.names[task_id] for task_id in matcher.prefix_candidates('petrenko_olena_5678_dekl')}
+    assert names == {'petrenko_olena_5678'}
+    names = {matcher.names[task_id] for task_id in matcher.prefix_candidates('s')}
+    assert names == {'sydorenko_taras_9'}
+
+
+def test_augment_suffixed_filename_with_short_name():
+    row = [''] * 318
+    row[fix.COL_FILENAME] = fix.normalize_fname('ivanenko_ivan_1234 копія.pdf')
+    row[fix.COL_NAME] = 'Іваненко'
+    tasks = make_matcher()
+    row = fix.augment(row, tasks, Counter(), {})
+    assert row[fix.COL_LINK] == '/d/1/ivanenko_ivan_1234.pdf'
@@ -0,0 +1,127 @@
+"""Joins of merge.py, the in-memory hash join compared with the sort-merge join on disk"""
+import io
+import os
+import csv
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import merge  # noqa: E402
+import extsort  # noqa: E402
+
+ORIGINAL = '''Номер групи;Ім'я;Ключ
+1;Іваненко;a
+2;Петренко;b
+1;Коваленко;a
+3;Шевченко;c
+4;Мельник;
+2;Бойко;b
+5;Лисенко
+'''
+MOVABLES = '''Ключ;ОБЩ Авто;Результат сверки машин
+b;BMW;так
+a;Audi;ні
+a;Opel;так
+d;Skoda;ні
+b;Fiat;ні
+;Порожній;ні
+'''
+POSITIONS = '''Номер групи;Регіон;Структура;Посада
+2;Київ;Суд;Суддя
+1;Львів;Прокуратура;Прокурор
+2;Одеса;Суд;Голова
+7;Харків;Рада;Депутат
+'''
+
+
+def read(text):
+    return list(csv.DictReader(io.StringIO(text), delimiter=';'))
+
+
+def join(monkeypatch, merge_func, *args, **kwargs):
+    """Joined rows and the JoinReport of the join"""
+    reports = []
+
+    class RecordedReport(merge.JoinReport):
+        def __init__(self, name):
+            super().__init__(name)
+            reports.append(self)
+
+    monkeypatch.setattr(merge, 'JoinReport', RecordedReport)
+    rows = list(merge_func(*args, **kwargs))
+    report, = reports
+    return rows, (report.matched, report.unmatched, report.duplicate_keys, report.unused_keys)
+
+
+def join_movables(monkeypatch, original, movables, in_memory):
+    return join(monkeypatch, merge.merge_movables, original, movables, merge.movables_columns(movables[0].keys()),
+                'Ключ', in_memory, memory_budget=0)
+
+
+def join_positions(monkeypatch, original, positions, in_memory):
+    return join(monkeypatch, merge.merge_positions, original, positions, in_memory, memory_budget=0)
+
+
+@pytest.fixture(autouse=True)
+def small_fan_in(monkeypatch):
+    monkeypatch.setattr(extsort, 'MAX_FAN_IN', 3)
+
+
+@pytest.mark.parametrize('in_memory', [True, False])
+def test_movables(monkeypatch, in_memory):
+    rows, report = join_movables(monkeypatch, read(ORIGINAL), read(MOVABLES), in_memory)
+    assert [(row["Ім'я"], row.get('ОБЩ Авто')) for row in rows] == [
+        ('Іваненко', 'Audi'), ('Петренко', 'BMW'), ('Коваленко', 'Audi'), ('Шевченко', None),
+        ('Мельник', 'Порожній'), ('Бойко', 'BMW'), ('Лисенко', 'Порожній')]
+    assert report == (6, 1, {'a', 'b'}, {'d'})
+
+
+@pytest.mark.parametrize('in_memory', [True, False])
+def test_positions(monkeypatch, in_memory):
+    rows, report = join_positions(monkeypatch, read(ORIGINAL), read(POSITIONS), in_memory)
+    assert [(row["Ім'я"], row['Регіон']) for row in rows] == [
+        ('Іваненко', 'Львів'), ('Петренко', 'Київ'), ('Коваленко', 'Львів'), ('Бойко', 'Київ')]
+    assert report == (4, 3, {'2'}, {'7'})
+
+
+def test_short_build_rows(monkeypatch):
+    positions = POSITIONS.replace('1;Львів;Прокуратура;Прокурор', '1;Львів')
+    movables = MOVABLES.replace('a;Audi;ні', 'a;Audi')
+    joined = []
+    for in_memory in (True, False):
+        rows, _ = join_movables(monkeypatch, read(ORIGINAL), read(movables), in_memory)
+        rows, _ = join_positions(monkeypatch, rows, read(positions), in_memory)
+        joined.append(rows)
+    assert joined[0] == joined[1]
+    first = joined[0][0]
+    assert (first['ОБЩ Авто'], first['Результат сверки машин']) == ('Audi', None)
+    assert (first['Регіон'], first['Структура'], first['Посада']) == ('Львів', None, None)
+
+
+def random_rows(rnd, num_rows, key, num_keys, columns):
+    return [dict({key: str(rnd.randrange(num_keys))}, num=str(num), **{col: rnd.choice('xyz') for col in columns})
+            for num in range(num_rows)]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_in_memory_and_on_disk_agree(monkeypatch, seed):
+    rnd = random.Random(seed)
+    original = random_rows(rnd, 200, 'Ключ', 60, ())
+    movables = random_rows(rnd, 80, 'Ключ', 70, ('ОБЩ Авто',))
+    positions = random_rows(rnd, 30, merge.GROUP_NUM_NAME, 40, merge.POSITION_COLS)
+    for row in original:
+        row[merge.GROUP_NUM_NAME] = str(rnd.randrange(40))
+
+    def copy(rows):
+        return [dict(row) for row in rows]
+
+    for in_memory in (True, False):
+        joined, movables_report = join_movables(monkeypatch, copy(original), copy(movables), in_memory)
+        joined, positions_report = join_positions(monkeypatch, joined, copy(positions), in_memory)
+        if in_memory:
+            expected = joined, movables_report, positions_report
+        else:
+            assert (joined, movables_report, positions_report) == expected
@@ -0,0 +1,75 @@
+"""Blocks and matches of the similar full names of namematch.py"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import namematch  # noqa: E402
+from namematch import name_tokens, blocking_keys, match_names  # noqa: E402
+
+
+def shared_keys(a, b):
+    return blocking_keys(name_tokens(a)) & blocking_keys(name_tokens(b))
+
+
+def matched(names, **kwargs):
+    return {(names[a], names[b]) for a, b, _ in match_names(names, **kwargs)}
+
+
+def test_name_tokens():
+    assert name_tokens('Іваненко Іван Петрович') == ('ivanenko', 'ivan', 'petrovych')
+    assert name_tokens("Ґудзь-Мар'яна О.") == ('gudz', 'mariana', 'o')
+    assert name_tokens('Ivanenko Ivan Petrovych') == name_tokens('Іваненко Іван Петрович')
+
+
+@pytest.mark.parametrize('a, b, kind', [
+    # Same tokens in another order
+    ('іван іваненко', 'іваненко іван', 's:'),
+    # Transliterated differently, the same consonants
+    ('хмара олег', 'hmara oleh', 'p:'),
+    ('іваненко іван петрович', 'іваненко іван петровіч', 'p:'),
+    # Full name and the initials of the rest of it
+    ('іваненко іван петрович', 'іваненко і п', 'x:'),
+])
+def test_blocking_keys(a, b, kind):
+    assert any(key.startswith(kind) for key in shared_keys(a, b))
+
+
+def test_different_names_are_not_blocked_together():
+    assert not shared_keys('іваненко іван петрович', 'петренко олена')
+
+
+def test_similar_names_are_matched():
+    names = ['іваненко іван петрович', 'іваненко і п', 'петренко олена', 'іваненко іван петровіч',
+             'іван іваненко петрович', 'хмара олег', 'hmara oleh']
+    assert matched(names) == {
+        ('іваненко іван петрович', 'іваненко іван петровіч'), ('іваненко іван петрович', 'іван іваненко петрович'),
+        ('іваненко іван петровіч', 'іван іваненко петрович'), ('хмара олег', 'hmara oleh'),
+    }
+
+
+def test_scores():
+    scores = {(a, b): score for a, b, score in match_names(['іван іваненко', 'іваненко іван', 'іваненко іванн'])}
+    assert scores[(0, 1)] == 1.0
+    assert namematch.MIN_SCORE <= scores[(1, 2)] < 1.0
+
+
+def test_initials_alone_are_not_matched():
+    assert matched(['і п', 'п і']) == set()
+
+
+def test_connected_names_are_not_compared():
+    names = ['хмара олег', 'hmara oleh', 'іван іваненко', 'іваненко іван']
+    assert matched(names, connected=lambda a, b: a < 2 and b < 2) == {('іван іваненко', 'іваненко іван')}
+
+
+def test_big_blocks_are_compared_within_the_window(monkeypatch):
+    monkeypatch.setattr(namematch, 'MAX_BLOCK_SIZE', 4)
+    monkeypatch.setattr(namematch, 'WINDOW', 2)
+    sort_keys = ['d', 'a', 'c', 'b', 'e']
+    assert len(list(namematch.block_pairs([0, 1, 2, 3], sort_keys))) == 6
+    # Sorted they are 1, 3, 2, 0, 4 and each is compared to the next two of them
+    expected = {(1, 3), (1, 2), (3, 2), (3, 0), (2, 0), (2, 4), (0, 4)}
+    assert set(namematch.block_pairs([0, 1, 2, 3, 4], sort_keys)) == expected
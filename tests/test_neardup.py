@@ -0,0 +1,74 @@
+"""Near duplicate clusters of neardup.find_near_duplicates()"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import neardup  # noqa: E402
+from neardup import find_near_duplicates  # noqa: E402
+
+WIDTH = 40
+COLUMNS = list(range(WIDTH))
+
+
+def change(rnd, row, num_cols):
+    row = list(row)
+    for col in rnd.sample(COLUMNS, num_cols):
+        row[col] = 'changed-{}'.format(rnd.random())
+    return row
+
+
+def make_rows(seed=0, num_bases=10, copies=3):
+    """Chains of rows: a base row, its copies changed in two columns and copies of those changed in two more
+
+    A copy of a copy is similar to its own copy but not to the base row, so it is only clustered right when it's
+    compared to more than the first row of a bucket.
+    """
+    rnd = random.Random(seed)
+    rows = []
+    for base_num in range(num_bases):
+        base = ['{}-{}'.format(base_num, col) for col in range(WIDTH)]
+        rows.append(base)
+        for _ in range(copies):
+            copy = change(rnd, base, 2)
+            rows.extend([copy, change(rnd, copy, 2)])
+    return rows
+
+
+def clusters_of(rows):
+    return {frozenset(tuple(rows[num]) for num in cluster) for cluster in find_near_duplicates(rows, COLUMNS, 0.8)}
+
+
+def test_similar_rows_are_clustered():
+    rows = make_rows()
+    clusters = clusters_of(rows)
+    assert len(clusters) == 10
+    assert all(len(cluster) == 7 for cluster in clusters)
+
+
+def test_clusters_do_not_depend_on_the_order():
+    for seed in range(10):
+        rows = make_rows(seed)
+        shuffled = list(rows)
+        random.Random(seed).shuffle(shuffled)
+        assert clusters_of(rows) == clusters_of(shuffled) == clusters_of(rows[::-1])
+
+
+def test_empty_rows_stay_single():
+    rows = [[''] * WIDTH, [''] * WIDTH]
+    assert find_near_duplicates(rows, COLUMNS, 0.8) == [[0], [1]]
+
+
+def test_features_of_every_row_are_made_once(monkeypatch):
+    calls = []
+
+    def row_features(row, columns):
+        calls.append(row)
+        return features(row, columns)
+
+    features = neardup.row_features
+    monkeypatch.setattr(neardup, 'row_features', row_features)
+    rows = make_rows()
+    assert len(clusters_of(rows)) == 10
+    assert len(calls) == len(rows)